@@ -1,6 +1,16 @@
 # Copyright: Ren Tatsumoto <tatsu at autistici.org> and contributors
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
-from .format import format_output
-from .kana_conv import is_kana_str, kana_to_moras, to_hiragana, to_katakana
+from .basic_types import FuriganaSegment
+from .dispatcher import Priority
+from .format import format_anki, format_html, format_output
+from .kana_conv import (
+    is_kana_str,
+    kana_to_moras,
+    mora_count,
+    mora_counts,
+    mora_offsets,
+    to_hiragana,
+    to_katakana,
+)
 from .mecab_controller import BasicMecabController, MecabController
@@ -7,6 +7,22 @@ from .mecab_controller import MecabController
 
 
 def main():
+    if sys.argv[1:2] == ["serve"]:
+        from .daemon import main as serve
+
+        return serve(sys.argv[2:])
+    if sys.argv[1:2] == ["stream"]:
+        from .stream import main as stream
+
+        return stream(sys.argv[2:])
+    if sys.argv[1:2] == ["bench-backends"]:
+        from .backends import main as bench_backends
+
+        return bench_backends(sys.argv[2:])
+    if sys.argv[1:2] == ["load-test"]:
+        from .load_test import main as load_test
+
+        return load_test(sys.argv[2:])
     mecab = MecabController(verbose=False)
     print(mecab.reading(" ".join(sys.argv[1:])))
 
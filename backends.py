@@ -0,0 +1,524 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Backends that run mecab for MecabController, and a benchmark that compares the installed ones:
+
+    python -m mecab_controller bench-backends corpus.txt
+
+Every backend prints mecab's output for its input in the format set by mecab_args,
+so parsing, replace_mistakes and formatting work the same on top of any of them.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import subprocess
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from typing import NamedTuple, Optional, Protocol
+
+try:
+    from .background import BackgroundJob
+    from .basic_mecab_controller import (
+        MECAB_TIMEOUT_SEC,
+        BasicMecabController,
+        MecabCrashError,
+        MecabError,
+        MecabTimeoutError,
+        check_mecab_errors,
+        check_mecab_rc,
+        expr_to_bytes,
+    )
+    from .basic_types import COMPONENTS, Separators
+    from .mecab_exe_finder import IS_MAC, IS_WIN, SUPPORT_DIR
+except ImportError:
+    from background import BackgroundJob
+    from basic_mecab_controller import (
+        MECAB_TIMEOUT_SEC,
+        BasicMecabController,
+        MecabCrashError,
+        MecabError,
+        MecabTimeoutError,
+        check_mecab_errors,
+        check_mecab_rc,
+        expr_to_bytes,
+    )
+    from basic_types import COMPONENTS, Separators
+    from mecab_exe_finder import IS_MAC, IS_WIN, SUPPORT_DIR
+
+try:
+    import fugashi
+except ImportError:
+    fugashi = None
+
+PROBE_TEXT = (
+    "昨日すき焼きを食べました",
+    "詳細はお気軽にお問い合わせ下さい。",
+    "カリン、自分でまいた種は自分で刈り取れ",
+)
+PROBE_TIMEOUT_SEC = 10
+
+
+class BackendUnavailableError(RuntimeError):
+    """The backend can't run here, e.g. its library isn't installed."""
+
+
+class MecabBackend(Protocol):
+    def run(self, expr: str) -> str:
+        """mecab's output for expr. Each line of expr is analyzed separately, like the mecab command does."""
+        ...
+
+    def iter_run(self, expr: str, separator: str) -> Iterator[str]:
+        """Like run(), split on separator. Backends that can stream yield each piece as soon as it arrives."""
+        ...
+
+    def buffer_bytes(self) -> int:
+        """Memory held by preallocated buffers."""
+        ...
+
+
+def dictionary_args(mecab_cmd: Optional[list[str]]) -> list[str]:
+    """The options of the mecab command, i.e. everything except the executable."""
+    return (mecab_cmd or BasicMecabController._mecab_cmd)[1:]
+
+
+def stop_process(proc: subprocess.Popen) -> None:
+    """mecab exits at the end of its input."""
+    try:
+        proc.stdin.close()
+        proc.wait(MECAB_TIMEOUT_SEC)
+    except (OSError, subprocess.TimeoutExpired):
+        proc.kill()
+        proc.wait()
+    proc.stdout.close()
+
+
+class PersistentMecabController(BasicMecabController):
+    """
+    Keeps mecab processes running and sends them one line at a time, so that mecab is started
+    and its dictionary loaded only once instead of for every call.
+    Concurrent callers (e.g. the dispatcher's workers) take a process from a pool, so each runs its own.
+    Needs a node format without line breaks, so that mecab prints exactly one line for each line of input.
+    """
+
+    _idle: list[subprocess.Popen]
+    _closed: bool
+
+    def __init__(
+        self,
+        mecab_cmd: Optional[list[str]] = None,
+        mecab_args: Optional[list[str]] = None,
+        verbose: bool = False,
+    ) -> None:
+        mecab_args = list(mecab_args or self._mecab_args)
+        if not any(arg.startswith("--node-format=") and "\n" not in arg for arg in mecab_args):
+            raise ValueError("the persistent backend needs a --node-format without line breaks.")
+        # mecab's output for each line of input ends with a line break.
+        mecab_args = [
+            arg + "\n" if arg.startswith("--eos-format=") and not arg.endswith("\n") else arg for arg in mecab_args
+        ]
+        super().__init__(mecab_cmd, mecab_args, verbose)
+        self._idle = []
+        self._closed = False
+
+    def _acquire(self) -> subprocess.Popen:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._spawn()
+
+    def _release(self, proc: subprocess.Popen) -> None:
+        with self._lock:
+            if not self._closed:
+                self._idle.append(proc)
+                return
+        stop_process(proc)
+
+    def run(self, expr: str) -> str:
+        proc = self._acquire()
+        timed_out = threading.Event()
+        watchdog = threading.Timer(MECAB_TIMEOUT_SEC, lambda: (timed_out.set(), proc.kill()))
+        watchdog.start()
+        outputs = []
+        try:
+            for line in expr.split("\n"):
+                # One line at a time, so that mecab never blocks on writing output that isn't being read.
+                proc.stdin.write(expr_to_bytes(line))
+                proc.stdin.flush()
+                output = proc.stdout.readline()
+                if not output:
+                    break
+                outputs.append(output.rstrip(b"\r\n").decode("utf-8", "replace"))
+        except OSError:
+            pass
+        finally:
+            watchdog.cancel()
+        str_out = "".join(outputs)
+        check_mecab_errors(str_out)
+        if len(outputs) < expr.count("\n") + 1:
+            # mecab exited or was killed by the watchdog. The process can't be reused.
+            proc.kill()
+            proc.wait()
+            proc.stdout.close()
+            if timed_out.is_set():
+                raise MecabTimeoutError(f"mecab took longer than {MECAB_TIMEOUT_SEC} seconds.")
+            if proc.returncode < 0:
+                raise MecabCrashError(f"mecab was terminated by signal {-proc.returncode}.")
+            raise MecabError(f"mecab exited with code {proc.returncode} before analyzing all input.")
+        self._release(proc)
+        return str_out
+
+    def iter_run(self, expr: str, separator: str) -> Iterator[str]:
+        yield from self.run(expr).split(separator)
+
+    def close(self) -> None:
+        """Stops the mecab processes. Busy processes are stopped once they finish their input."""
+        with self._lock:
+            self._closed = True
+            procs, self._idle = self._idle, []
+        for proc in procs:
+            stop_process(proc)
+
+
+def find_libmecab() -> Optional[str]:
+    """The libmecab bundled in the "support" dir, or the one installed in the system."""
+    bundled = os.path.join(
+        SUPPORT_DIR,
+        "libmecab.dll" if IS_WIN else "libmecab.2.dylib" if IS_MAC else "libmecab.so.1",
+    )
+    return bundled if os.path.isfile(bundled) else ctypes.util.find_library("mecab")
+
+
+class LibMecabController:
+    """
+    Calls libmecab through ctypes in this process. No process is started, and the dictionary is loaded once.
+    A tagger can only analyze one input at a time, so concurrent callers take one from a pool.
+    """
+
+    _lib: ctypes.CDLL
+    _argv: list[bytes]
+    _idle: list[int]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        mecab_cmd: Optional[list[str]] = None,
+        mecab_args: Optional[list[str]] = None,
+        verbose: bool = False,
+    ) -> None:
+        path = find_libmecab()
+        if path is None:
+            raise BackendUnavailableError("libmecab wasn't found.")
+        try:
+            self._lib = ctypes.CDLL(path)
+        except OSError as ex:
+            raise BackendUnavailableError(f"couldn't load {path}: {ex}") from ex
+        self._lib.mecab_new.argtypes = (ctypes.c_int, ctypes.POINTER(ctypes.c_char_p))
+        self._lib.mecab_new.restype = ctypes.c_void_p
+        self._lib.mecab_sparse_tostr.argtypes = (ctypes.c_void_p, ctypes.c_char_p)
+        self._lib.mecab_sparse_tostr.restype = ctypes.c_char_p
+        self._lib.mecab_strerror.argtypes = (ctypes.c_void_p,)
+        self._lib.mecab_strerror.restype = ctypes.c_char_p
+        self._lib.mecab_destroy.argtypes = (ctypes.c_void_p,)
+        self._lib.mecab_destroy.restype = None
+        check_mecab_rc()
+        self._argv = [
+            arg.encode("utf-8") for arg in ("mecab", *dictionary_args(mecab_cmd), *(mecab_args or ()))
+        ]
+        self._idle = []
+        self._lock = threading.Lock()
+        if verbose:
+            print("libmecab:", path, self._argv)
+        try:
+            # Fail early if the dictionary can't be loaded.
+            self._release(self._acquire())
+        except MecabError as ex:
+            raise BackendUnavailableError(str(ex)) from ex
+
+    def _acquire(self) -> int:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        tagger = self._lib.mecab_new(len(self._argv), (ctypes.c_char_p * len(self._argv))(*self._argv))
+        if not tagger:
+            raise MecabError(f"libmecab failed to start: {self._error(None)}")
+        return tagger
+
+    def _release(self, tagger: int) -> None:
+        with self._lock:
+            self._idle.append(tagger)
+
+    def _error(self, tagger: Optional[int]) -> str:
+        return (self._lib.mecab_strerror(tagger) or b"").decode("utf-8", "replace")
+
+    def run(self, expr: str) -> str:
+        tagger = self._acquire()
+        try:
+            outputs = []
+            for line in expr.split("\n"):
+                output = self._lib.mecab_sparse_tostr(tagger, line.encode("utf-8", "ignore"))
+                if output is None:
+                    raise MecabError(f"libmecab failed: {self._error(tagger)}")
+                outputs.append(output.decode("utf-8", "replace"))
+        finally:
+            self._release(tagger)
+        return "".join(outputs).rstrip("\r\n")
+
+    def iter_run(self, expr: str, separator: str) -> Iterator[str]:
+        yield from self.run(expr).split(separator)
+
+    def buffer_bytes(self) -> int:
+        return 0
+
+    def close(self) -> None:
+        with self._lock:
+            taggers, self._idle = self._idle, []
+        for tagger in taggers:
+            self._lib.mecab_destroy(tagger)
+
+
+class FugashiMecabController:
+    """
+    Uses fugashi, if it's installed, and prints its nodes in the format MecabController expects.
+    Custom mecab_args aren't supported, the output format is built from COMPONENTS.
+    """
+
+    _feature_indices: tuple[int, ...]
+    _args: str
+    _taggers: threading.local
+
+    def __init__(
+        self,
+        mecab_cmd: Optional[list[str]] = None,
+        mecab_args: Optional[list[str]] = None,
+        verbose: bool = False,
+    ) -> None:
+        if fugashi is None:
+            raise BackendUnavailableError("fugashi isn't installed.")
+        args = dictionary_args(mecab_cmd)
+        if any(" " in arg for arg in args):
+            raise BackendUnavailableError("fugashi can't pass paths with spaces to mecab.")
+        check_mecab_rc()
+        # Indices of the features that make up each component after the word, e.g. 6 for %f[6].
+        self._feature_indices = tuple(int(component[3:-1]) for component in COMPONENTS[1:])
+        self._args = " ".join(args)
+        self._taggers = threading.local()
+        if verbose:
+            print("fugashi args:", self._args)
+        self._tagger()
+
+    def _tagger(self) -> "fugashi.GenericTagger":
+        """Each thread gets its own tagger."""
+        try:
+            return self._taggers.tagger
+        except AttributeError:
+            try:
+                self._taggers.tagger = fugashi.GenericTagger(self._args)
+            except RuntimeError as ex:
+                raise BackendUnavailableError(f"fugashi failed to start: {ex}") from ex
+            return self._taggers.tagger
+
+    def _format_node(self, node) -> str:
+        if node.is_unk:
+            # Same as --unk-format.
+            return node.surface + Separators.node
+        features = node.feature
+        components = [node.surface]
+        for idx in self._feature_indices:
+            components.append(features[idx] if idx < len(features) else "")
+        return Separators.component.join(components) + Separators.node
+
+    def run(self, expr: str) -> str:
+        tagger = self._tagger()
+        return "".join(
+            "".join(map(self._format_node, tagger(line))) + Separators.footer for line in expr.split("\n")
+        )
+
+    def iter_run(self, expr: str, separator: str) -> Iterator[str]:
+        yield from self.run(expr).split(separator)
+
+    def buffer_bytes(self) -> int:
+        return 0
+
+
+# Backends by name. Each is constructed with (mecab_cmd, mecab_args, verbose).
+BACKENDS: dict[str, type] = {
+    "subprocess": BasicMecabController,
+    "persistent": PersistentMecabController,
+    "libmecab": LibMecabController,
+    "fugashi": FugashiMecabController,
+}
+
+
+def make_backend(
+    name: str,
+    mecab_cmd: Optional[list[str]] = None,
+    mecab_args: Optional[list[str]] = None,
+    verbose: bool = False,
+) -> MecabBackend:
+    """A backend from BACKENDS, or the fastest available one if name is "auto"."""
+    if name == "auto":
+        return fastest_backend(mecab_cmd, mecab_args, verbose)
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"unknown backend: {name}") from None
+    return backend_class(mecab_cmd=mecab_cmd, mecab_args=mecab_args, verbose=verbose)
+
+
+def close_backend(backend: Optional[MecabBackend]) -> None:
+    """Stops the processes or frees the taggers held by the backend, if it has any."""
+    if hasattr(backend, "close"):
+        backend.close()
+
+
+class BackendTiming(NamedTuple):
+    name: str
+    startup_sec: float
+    run_sec: float  # time to analyze all inputs
+    n_inputs: int
+    same_output: bool  # same output as the first backend that ran
+    error: Optional[str]
+
+    @property
+    def inputs_per_sec(self) -> float:
+        return self.n_inputs / self.run_sec if self.run_sec else 0.0
+
+
+def time_backend(
+    name: str,
+    exprs: Sequence[str],
+    mecab_cmd: Optional[list[str]] = None,
+    mecab_args: Optional[list[str]] = None,
+    timeout: float = PROBE_TIMEOUT_SEC,
+) -> tuple[BackendTiming, list[str], Optional[MecabBackend]]:
+    """
+    Starts the backend and runs every input through it.
+    The backend runs in a background thread, so a backend that hangs (e.g. on a broken dictionary)
+    is given up on after timeout seconds.
+    """
+    result: dict[str, object] = {}
+    # Decides who closes the backend if the run is given up on around the time it finishes.
+    handover_lock = threading.Lock()
+
+    def measure(cancelled: threading.Event) -> None:
+        start = time.perf_counter()
+        backend = make_backend(name, mecab_cmd, mecab_args)
+        result["startup"] = time.perf_counter() - start
+        try:
+            start = time.perf_counter()
+            outputs = []
+            for expr in exprs:
+                if cancelled.is_set():
+                    return
+                outputs.append(backend.run(expr))
+            result["run"] = time.perf_counter() - start
+            result["outputs"] = outputs
+        finally:
+            with handover_lock:
+                if "outputs" in result and not cancelled.is_set():
+                    # The caller takes over the backend.
+                    result["backend"] = backend
+                else:
+                    close_backend(backend)
+
+    job = BackgroundJob(measure, name=f"mecab_probe_{name}")
+    try:
+        finished = job.wait(timeout)
+    except Exception as ex:
+        # Whatever went wrong, the backend can't be used.
+        return BackendTiming(name, 0.0, 0.0, len(exprs), False, str(ex)), [], None
+    if not finished:
+        with handover_lock:
+            job.cancel()
+            # The run may have finished after the timeout.
+            close_backend(result.pop("backend", None))
+        return BackendTiming(name, 0.0, 0.0, len(exprs), False, f"no output after {timeout} seconds"), [], None
+    timing = BackendTiming(name, result["startup"], result["run"], len(exprs), True, None)
+    return timing, result["outputs"], result["backend"]
+
+
+def benchmark_backends(
+    exprs: Sequence[str],
+    names: Sequence[str] = tuple(BACKENDS),
+    mecab_cmd: Optional[list[str]] = None,
+    mecab_args: Optional[list[str]] = None,
+    timeout: float = PROBE_TIMEOUT_SEC,
+) -> list[BackendTiming]:
+    """Times each backend on the same inputs and checks that their output matches."""
+    timings = []
+    reference: Optional[list[str]] = None
+    for name in names:
+        timing, outputs, backend = time_backend(name, exprs, mecab_cmd, mecab_args, timeout)
+        if timing.error is None:
+            if reference is None:
+                reference = outputs
+            timing = timing._replace(same_output=(outputs == reference))
+        close_backend(backend)
+        timings.append(timing)
+    return timings
+
+
+def fastest_backend(
+    mecab_cmd: Optional[list[str]] = None,
+    mecab_args: Optional[list[str]] = None,
+    verbose: bool = False,
+) -> MecabBackend:
+    """
+    Tries every backend on a few sentences and returns the fastest one
+    whose output matches the first backend that works (normally the mecab command).
+    """
+    best: Optional[tuple[float, MecabBackend]] = None
+    reference: Optional[list[str]] = None
+    for name in BACKENDS:
+        timing, outputs, backend = time_backend(name, PROBE_TEXT, mecab_cmd, mecab_args)
+        if verbose:
+            print(f"backend {name}: {timing.error or f'{timing.run_sec * 1000:.1f} ms'}")
+        if timing.error is None and reference is None:
+            reference = outputs
+        if timing.error is None and outputs == reference and (best is None or timing.run_sec < best[0]):
+            if best is not None:
+                close_backend(best[1])
+            best = (timing.run_sec, backend)
+        else:
+            close_backend(backend)
+    if best is None:
+        raise BackendUnavailableError("no mecab backend works.")
+    return best[1]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    try:
+        from .mecab_controller import MecabController
+    except ImportError:
+        from mecab_controller import MecabController
+
+    parser = argparse.ArgumentParser(description="Compare mecab backends on the same inputs.")
+    parser.add_argument("corpus", nargs="?", help="text file, one input per line. A few sample sentences by default")
+    parser.add_argument("--backends", nargs="+", choices=tuple(BACKENDS), default=tuple(BACKENDS))
+    parser.add_argument("--timeout", type=float, default=60.0, help="give up on a backend after this many seconds")
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            exprs = [line.rstrip("\r\n") for line in f]
+    else:
+        exprs = list(PROBE_TEXT) * 100
+    # The same output format MecabController parses.
+    mecab_args = MecabController._mecab_args
+    print(f"{'backend':>12} {'startup, ms':>12} {'inputs/s':>10} {'same output':>12}")
+    for timing in benchmark_backends(exprs, args.backends, mecab_args=mecab_args, timeout=args.timeout):
+        if timing.error:
+            print(f"{timing.name:>12} unavailable: {timing.error}")
+        else:
+            print(
+                f"{timing.name:>12} {timing.startup_sec * 1000:12.1f} {timing.inputs_per_sec:10.1f}"
+                f" {'yes' if timing.same_output else 'NO':>12}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import threading
+from collections.abc import Callable
+from typing import Optional
+
+
+class BackgroundJob:
+    """
+    Runs target(cancelled) on a daemon thread.
+    The target is expected to check the `cancelled` event between steps and return early once it's set.
+    """
+
+    _cancelled: threading.Event
+    _thread: threading.Thread
+    _error: Optional[BaseException]
+
+    def __init__(self, target: Callable[[threading.Event], None], name: str) -> None:
+        self._cancelled = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(target,), name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self, target: Callable[[threading.Event], None]) -> None:
+        try:
+            target(self._cancelled)
+        except Exception as ex:
+            self._error = ex
+
+    def cancel(self) -> None:
+        """Ask the job to stop. Doesn't wait for it, see wait()."""
+        self._cancelled.set()
+
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def done(self) -> bool:
+        return not self._thread.is_alive()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the job to finish. Returns False on timeout. Re-raises the job's exception, if any."""
+        self._thread.join(timeout)
+        if self._error is not None:
+            raise self._error
+        return self.done()
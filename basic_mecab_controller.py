@@ -1,21 +1,45 @@
 # Copyright: Ren Tatsumoto <tatsu at autistici.org> and contributors
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
-import functools
+import codecs
 import os
 import subprocess
+import threading
+import time
+import weakref
+from collections.abc import Iterator
 from typing import Optional
 
 try:
     from .mecab_exe_finder import IS_WIN, SUPPORT_DIR, find_executable
+    from .memoize import memoize
 except ImportError:
     from mecab_exe_finder import IS_WIN, SUPPORT_DIR, find_executable
+    from memoize import memoize
 
 INPUT_BUFFER_SIZE = str(819200)
 MECAB_RC_PATH = os.path.join(SUPPORT_DIR, "mecabrc")
+MECAB_TIMEOUT_SEC = 5
+READ_BUFFER_SIZE = 64 * 1024
 
 
-@functools.cache
+class MecabError(RuntimeError):
+    """Mecab failed to analyze the input."""
+
+
+class MecabTimeoutError(MecabError):
+    """Mecab didn't finish analyzing the input in time and had to be killed."""
+
+
+class MecabCrashError(MecabError):
+    """Mecab was terminated by a signal while analyzing the input."""
+
+
+class MecabStartError(MecabError):
+    """Mecab couldn't be started or couldn't load its dictionary."""
+
+
+@memoize
 def startup_info():
     if IS_WIN:
         # Prevents a console window from popping up on Windows
@@ -26,7 +50,7 @@ def startup_info():
     return si
 
 
-@functools.cache
+@memoize
 def find_best_dic_dir():
     """
     If the user has mecab-ipadic-neologd (or mecab-ipadic) installed, pick its system dictionary.
@@ -66,12 +90,93 @@ def mecab_output_to_str(outs: bytes) -> str:
     return outs.rstrip(b"\r\n").decode("utf-8", "replace")
 
 
-def prepend_library_path() -> None:
+def check_mecab_errors(str_out: str) -> None:
+    if "tagger.cpp" in str_out and "no such file or directory" in str_out:
+        raise MecabStartError("Please ensure your Windows user name contains only English characters.")
+
+
+def write_and_close(pipe, data: bytes) -> None:
+    try:
+        pipe.write(data)
+        pipe.close()
+    except OSError:
+        # mecab exited before reading all input.
+        pass
+
+
+class MecabWatchdog:
+    """
+    Kills the process once it has been running for longer than timeout seconds in total.
+    Time spent paused, e.g. while the caller is busy with the output read so far, doesn't count.
+    """
+
+    _proc: subprocess.Popen
+    _cond: threading.Condition
+    _remaining: float
+    _running_since: Optional[float]  # None while paused
+    _stopped: bool
+    timed_out: bool
+
+    def __init__(self, proc: subprocess.Popen, timeout: float) -> None:
+        self._proc = proc
+        self._cond = threading.Condition()
+        self._remaining = timeout
+        self._running_since = time.monotonic()
+        self._stopped = False
+        self.timed_out = False
+        threading.Thread(target=self._run, name="mecab_watchdog", daemon=True).start()
+
+    def pause(self) -> None:
+        with self._cond:
+            if self._running_since is not None:
+                self._remaining -= time.monotonic() - self._running_since
+                self._running_since = None
+
+    def resume(self) -> None:
+        with self._cond:
+            if self._running_since is None:
+                self._running_since = time.monotonic()
+                self._cond.notify()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _run(self) -> None:
+        with self._cond:
+            while not self._stopped:
+                if self._running_since is None:
+                    self._cond.wait()
+                elif (left := self._remaining - (time.monotonic() - self._running_since)) > 0:
+                    self._cond.wait(left)
+                else:
+                    self.timed_out = True
+                    self._proc.kill()
+                    return
+
+
+class _ReadBuffer:
+    """A thread's buffer for reading mecab's output. Tracked by a WeakSet, so it stops counting when its thread exits."""
+
+    __slots__ = ("data", "__weakref__")
+
+    def __init__(self, size: int) -> None:
+        self.data = bytearray(size)
+
+
+def mecab_environ() -> dict[str, str]:
+    """
+    Environment for the mecab process: the current environment with the "support" dir prepended to the library path.
+    os.environ itself is left alone, changing it isn't safe while other threads may be reading it.
+    """
+    env = dict(os.environ)
     for library_path in ("DYLD_LIBRARY_PATH", "LD_LIBRARY_PATH"):
         try:
-            os.environ[library_path] = f"{SUPPORT_DIR}:{os.environ[library_path]}"
+            env[library_path] = f"{SUPPORT_DIR}:{env[library_path]}"
         except KeyError:
-            os.environ[library_path] = SUPPORT_DIR
+            env[library_path] = SUPPORT_DIR
+    return env
 
 
 class BasicMecabController:
@@ -84,6 +189,10 @@ class BasicMecabController:
     ]
     _mecab_args: list[str] = []
     _verbose: bool
+    _env: dict[str, str]
+    _buffers: threading.local
+    _live_buffers: weakref.WeakSet
+    _lock: threading.Lock
 
     def __init__(
         self,
@@ -94,35 +203,109 @@ class BasicMecabController:
         super().__init__()
         check_mecab_rc()
         self._verbose = verbose
+        self._buffers = threading.local()
+        self._live_buffers = weakref.WeakSet()
+        self._lock = threading.Lock()
         self._mecab_cmd = normalize_for_platform((mecab_cmd or self._mecab_cmd) + (mecab_args or self._mecab_args))
-        prepend_library_path()
+        self._env = mecab_environ()
         if self._verbose:
             print("mecab cmd:", self._mecab_cmd)
 
-    def run(self, expr: str) -> str:
+    def _spawn(self) -> subprocess.Popen:
         try:
-            proc = subprocess.Popen(
+            return subprocess.Popen(
                 self._mecab_cmd,
                 bufsize=-1,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 startupinfo=startup_info(),
+                env=self._env,
             )
-        except OSError:
-            raise Exception("Please ensure your Linux system has 64 bit binary support.")
+        except OSError as ex:
+            raise MecabStartError(
+                f"couldn't start mecab: {ex}. Please ensure your Linux system has 64 bit binary support."
+            ) from ex
 
+    def run(self, expr: str) -> str:
+        proc = self._spawn()
         try:
-            outs, errs = proc.communicate(expr_to_bytes(expr), timeout=5)
+            outs, errs = proc.communicate(expr_to_bytes(expr), timeout=MECAB_TIMEOUT_SEC)
         except subprocess.TimeoutExpired:
             proc.kill()
-            outs, errs = proc.communicate()
+            proc.communicate()
+            raise MecabTimeoutError(f"mecab took longer than {MECAB_TIMEOUT_SEC} seconds.")
+
+        if proc.returncode < 0:
+            raise MecabCrashError(f"mecab was terminated by signal {-proc.returncode}.")
 
         str_out = mecab_output_to_str(outs)
-        if "tagger.cpp" in str_out and "no such file or directory" in str_out:
-            raise RuntimeError("Please ensure your Windows user name contains only English characters.")
+        check_mecab_errors(str_out)
         return str_out
 
+    def iter_run(self, expr: str, separator: str) -> Iterator[str]:
+        """
+        Like run(), but yields mecab's output split on separator as soon as each piece arrives,
+        instead of waiting for mecab to finish the whole input.
+        """
+        proc = self._spawn()
+        writer = threading.Thread(target=write_and_close, args=(proc.stdin, expr_to_bytes(expr)), daemon=True)
+        writer.start()
+        # Only the time spent waiting for mecab counts, not the time the caller takes to consume the output.
+        watchdog = MecabWatchdog(proc, MECAB_TIMEOUT_SEC)
+        try:
+            yield from self._iter_output(proc, separator, watchdog)
+            proc.wait()
+        finally:
+            watchdog.stop()
+            if proc.poll() is None:
+                # The caller stopped iterating early.
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            writer.join()
+        if watchdog.timed_out:
+            raise MecabTimeoutError(f"mecab took longer than {MECAB_TIMEOUT_SEC} seconds.")
+        if proc.returncode < 0:
+            raise MecabCrashError(f"mecab was terminated by signal {-proc.returncode}.")
+
+    def _iter_output(self, proc: subprocess.Popen, separator: str, watchdog: MecabWatchdog) -> Iterator[str]:
+        buf = self._read_buffer()
+        view = memoryview(buf)
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        pending = ""
+        checked = False
+        while n_read := proc.stdout.readinto1(view):
+            pending += decoder.decode(view[:n_read])
+            if not checked:
+                check_mecab_errors(pending)
+                checked = True
+            *parts, pending = pending.split(separator)
+            if parts:
+                watchdog.pause()
+                yield from parts
+                watchdog.resume()
+        pending = (pending + decoder.decode(b"", final=True)).rstrip("\r\n")
+        if pending:
+            watchdog.pause()
+            yield pending
+            watchdog.resume()
+
+    def _read_buffer(self) -> bytearray:
+        """Each thread reuses its own preallocated buffer for reading mecab's output."""
+        try:
+            return self._buffers.buf.data
+        except AttributeError:
+            buf = self._buffers.buf = _ReadBuffer(READ_BUFFER_SIZE)
+            with self._lock:
+                self._live_buffers.add(buf)
+            return buf.data
+
+    def buffer_bytes(self) -> int:
+        """Memory held by the preallocated read buffers of the threads that are still running."""
+        with self._lock:
+            return len(self._live_buffers) * READ_BUFFER_SIZE
+
 
 def main():
     mecab = BasicMecabController()
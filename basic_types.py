@@ -116,6 +116,29 @@ class MecabParsedToken:
 assert tuple(field.name for field in dataclasses.fields(MecabParsedToken)) == tuple(type(COMPONENTS).__annotations__)
 
 
+class TokenSpan(typing.NamedTuple):
+    # A token and its position in the original (unescaped) text, i.e. text[start:end].
+    token: MecabParsedToken
+    start: int
+    end: int
+
+
+class FuriganaSegment(typing.NamedTuple):
+    # A piece of text and its reading in hiragana, or None if it doesn't need one (e.g. kana).
+    base: str
+    ruby: Optional[str]
+
+
+class TextEdit(typing.NamedTuple):
+    # Replace text[start:end] with `replacement`.
+    start: int
+    end: int
+    replacement: str
+
+    def apply(self, text: str) -> str:
+        return text[: self.start] + self.replacement + text[self.end :]
+
+
 def main():
     for k in COMPONENTS:
         print(k)
@@ -0,0 +1,39 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Fixed-size cache keys for long inputs, so that caches don't keep a copy of every input alive.
+"""
+
+import hashlib
+
+DIGEST_SIZE = 16  # 128 bits
+CHECK_SIZE = 8  # 64 bits
+
+
+def digest_key(escaped: str) -> bytes:
+    return hashlib.blake2b(escaped.encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+def check_digest(escaped: str) -> bytes:
+    """
+    A second digest, independent of digest_key(), stored next to a cache entry and compared on every hit.
+    Two inputs whose digest keys collide are told apart by it.
+    """
+    return hashlib.blake2b(escaped.encode("utf-8"), digest_size=CHECK_SIZE, person=b"mecab_check").digest()
+
+
+def main():
+    import sys
+
+    text = "昨日すき焼きを食べました。" * 200
+    assert digest_key(text) == digest_key(text[:]) != digest_key(text + " ")
+    assert len(digest_key(text)) == DIGEST_SIZE
+    assert check_digest(text) == check_digest(text[:]) != check_digest(text + " ")
+    assert check_digest(text) != digest_key(text)[:CHECK_SIZE]
+    print(f"text key: {sys.getsizeof(text)} bytes, digest key: {sys.getsizeof(digest_key(text))} bytes")
+    print("Ok.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+An analysis cache that keeps entries in a compact encoded form and decodes them into tokens on access.
+"""
+
+import sys
+import zlib
+from collections.abc import Sequence
+from typing import Optional, Union
+
+try:
+    from .basic_types import Inflection, MecabParsedToken, PartOfSpeech
+    from .lru_cache import CacheStats, LRUCache
+except ImportError:
+    from basic_types import Inflection, MecabParsedToken, PartOfSpeech
+    from lru_cache import CacheStats, LRUCache
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+
+FIELD_SEP = "\x1f"
+TOKEN_SEP = "\x1e"
+SAME_AS_WORD = "\x1d"  # stored instead of the headword when it equals the word
+POS_CODES: tuple[PartOfSpeech, ...] = tuple(PartOfSpeech)
+POS_TO_CODE: dict[PartOfSpeech, str] = {pos: chr(code + 0x30) for code, pos in enumerate(POS_CODES)}
+INFLECTION_CODES: tuple[Inflection, ...] = tuple(Inflection)
+INFLECTION_TO_CODE: dict[Inflection, str] = {infl: chr(code + 0x30) for code, infl in enumerate(INFLECTION_CODES)}
+RESERVED = (FIELD_SEP, TOKEN_SEP, SAME_AS_WORD)
+
+# First byte of every encoded entry.
+RAW, ZLIB, ZSTD = b"r", b"z", b"s"
+
+
+def encode_tokens(tokens: Sequence[MecabParsedToken]) -> str:
+    """
+    Encodes tokens in a form close to mecab's own output: one token per record, one field per column,
+    with the part of speech and inflection type stored as one-character codes.
+    Raises ValueError if a token contains a reserved character.
+    """
+    records = []
+    for token in tokens:
+        text = token.word + token.headword + (token.katakana_reading or "")
+        if any(char in text for char in RESERVED):
+            raise ValueError("token contains a reserved character.")
+        headword = SAME_AS_WORD if token.headword == token.word else token.headword
+        records.append(
+            FIELD_SEP.join(
+                (
+                    token.word,
+                    headword,
+                    token.katakana_reading or "",
+                    POS_TO_CODE[token.part_of_speech],
+                    INFLECTION_TO_CODE[token.inflection_type],
+                )
+            )
+        )
+    return TOKEN_SEP.join(records)
+
+
+def decode_tokens(encoded: str) -> tuple[MecabParsedToken, ...]:
+    if not encoded:
+        return ()
+    tokens = []
+    for record in encoded.split(TOKEN_SEP):
+        word, headword, katakana_reading, pos_code, inflection_code = record.split(FIELD_SEP)
+        tokens.append(
+            MecabParsedToken(
+                word=word,
+                headword=(word if headword == SAME_AS_WORD else headword),
+                katakana_reading=(katakana_reading or None),
+                part_of_speech=POS_CODES[ord(pos_code) - 0x30],
+                inflection_type=INFLECTION_CODES[ord(inflection_code) - 0x30],
+            )
+        )
+    return tuple(tokens)
+
+
+class CompactCache:
+    """
+    A drop-in replacement for LRUCache[str, Sequence[MecabParsedToken]].
+    Entries are stored encoded (see encode_tokens()), optionally compressed, and decoded when they are read.
+    The most recently read entries are also kept decoded in a small hot tier.
+    """
+
+    _cold: LRUCache[str, Union[bytes, Sequence[MecabParsedToken]]]
+    _hot: LRUCache[str, Sequence[MecabParsedToken]]
+    _compression: Optional[str]
+
+    def __init__(self, capacity: int = 0, hot_capacity: int = 64, compression: Optional[str] = None) -> None:
+        """compression is None, "zlib" or "zstd" (needs Python 3.14+)."""
+        if compression not in (None, "zlib", "zstd"):
+            raise ValueError(f"unknown compression: {compression}")
+        if compression == "zstd" and zstd is None:
+            raise ValueError("zstd compression needs Python 3.14 or newer.")
+        self._cold = LRUCache(capacity)
+        self._hot = LRUCache(max(1, hot_capacity))
+        self._compression = compression
+
+    def __len__(self) -> int:
+        return len(self._cold)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sys.getsizeof(self._cold) + sys.getsizeof(self._hot)
+
+    def items(self) -> list[tuple[str, Sequence[MecabParsedToken]]]:
+        """Decoded entries, i.e. the hot tier."""
+        return self._hot.items()
+
+    def stats(self) -> CacheStats:
+        """Hits in either tier count as hits."""
+        hot, cold = self._hot.stats(), self._cold.stats()
+        return CacheStats(hot.hits + cold.hits, cold.misses)
+
+    def compact_bytes(self) -> int:
+        """Memory held by the keys and encoded values of all entries."""
+        return sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in self._cold.items())
+
+    def set_capacity(self, capacity: int) -> None:
+        self._cold.set_capacity(capacity)
+
+    def __getitem__(self, key: str) -> Sequence[MecabParsedToken]:
+        try:
+            tokens = self._hot[key]
+        except KeyError:
+            pass
+        else:
+            # Keep the entry from being evicted from the cold tier while it's in use.
+            self._cold.touch(key)
+            return tokens
+        value = self._cold[key]
+        tokens = self._decode(value) if isinstance(value, bytes) else value
+        self._hot[key] = tokens
+        return tokens
+
+    def __setitem__(self, key: str, tokens: Sequence[MecabParsedToken]) -> None:
+        self._cold[key] = self._encode(tokens)
+        self._hot[key] = tokens
+
+    def setdefault(self, key: str, tokens: Sequence[MecabParsedToken]) -> Sequence[MecabParsedToken]:
+        """Not counted as a lookup, like LRUCache.setdefault()."""
+        encoded = self._encode(tokens)
+        value = self._cold.setdefault(key, encoded)
+        if value is not encoded:
+            # Another thread stored the entry first.
+            tokens = self._decode(value) if isinstance(value, bytes) else value
+        self._hot[key] = tokens
+        return tokens
+
+    def _encode(self, tokens: Sequence[MecabParsedToken]) -> Union[bytes, Sequence[MecabParsedToken]]:
+        try:
+            data = encode_tokens(tokens).encode("utf-8")
+        except ValueError:
+            # Rare, e.g. control characters in the input. Stored as is.
+            return tokens
+        if self._compression == "zlib":
+            return ZLIB + zlib.compress(data)
+        if self._compression == "zstd":
+            return ZSTD + zstd.compress(data)
+        return RAW + data
+
+    @staticmethod
+    def _decode(value: bytes) -> Sequence[MecabParsedToken]:
+        kind, data = value[:1], value[1:]
+        if kind == ZLIB:
+            data = zlib.decompress(data)
+        elif kind == ZSTD:
+            data = zstd.decompress(data)
+        return decode_tokens(data.decode("utf-8"))
+
+
+def main():
+    try:
+        from .basic_types import Separators
+        from .mecab_controller import parse_mecab_output
+        from .memory_usage import measure_entries
+    except ImportError:
+        from basic_types import Separators
+        from mecab_controller import parse_mecab_output
+        from memory_usage import measure_entries
+
+    def fake_output(idx: int) -> str:
+        nodes = (
+            ("昨日", "昨日", "キノウ", "名詞", "*"),
+            ("すき焼き", "すき焼き", "スキヤキ", "名詞", "*"),
+            ("を", "を", "ヲ", "助詞", "*"),
+            (f"食べ{idx}", "食べる", "タベ", "動詞", "連用形"),
+            ("ました", "ます", "マシタ", "助動詞", "基本形"),
+        )
+        return "".join(Separators.component.join(node) + Separators.node for node in nodes) + Separators.footer
+
+    entries = [
+        (f"昨日すき焼きを食べ{idx}ました", tuple(parse_mecab_output(fake_output(idx))))
+        for idx in range(1000)
+    ]
+    decoded_bytes = measure_entries(entries).total_bytes
+    print(f"decoded: {decoded_bytes} bytes")
+    for compression in (None, "zlib", "zstd") if zstd else (None, "zlib"):
+        cache = CompactCache(hot_capacity=16, compression=compression)
+        for key, tokens in entries:
+            assert cache.setdefault(key, tokens) == tokens
+        for key, tokens in entries:
+            assert cache[key] == tokens
+        assert all(isinstance(value, bytes) for _, value in cache._cold.items())
+        compact_bytes = cache.compact_bytes()
+        print(f"{compression}: {compact_bytes} bytes, {decoded_bytes / compact_bytes:.1f}x smaller")
+        assert compact_bytes * 2 < decoded_bytes
+    cache = CompactCache(capacity=2, hot_capacity=2)
+    cache.setdefault("a", entries[0][1])
+    cache.setdefault("b", entries[1][1])
+    assert cache.stats() == (0, 0)
+    assert cache["a"] == entries[0][1]  # hot hit, refreshes "a" in the cold tier
+    cache.setdefault("c", entries[2][1])
+    assert [key for key, _ in cache._cold.items()] == ["a", "c"]
+    assert cache.stats() == (1, 0)
+    odd = (MecabParsedToken("a\x1fb", "a\x1fb", None, PartOfSpeech.unknown, Inflection.unknown),)
+    cache = CompactCache(hot_capacity=1)
+    cache["odd"] = odd
+    cache["other"] = entries[0][1]
+    assert cache["odd"] == odd
+    print("Ok.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Corpus mode: spread the whole reading() pipeline (mecab, parsing, replace_mistakes, formatting)
+across a pool of processes, so that the pure-Python stages aren't limited to one core by the GIL.
+On free-threaded Python, a pool of threads sharing one controller does the same without pickling.
+"""
+
+import collections
+import itertools
+import multiprocessing
+import os
+import sys
+from collections.abc import Callable, Collection, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.pool import AsyncResult
+from typing import Any, Optional, TypeVar
+
+try:
+    from .basic_types import PartOfSpeech
+    from .frequency import HeadwordCounter
+    from .mecab_controller import MecabController
+except ImportError:
+    from basic_types import PartOfSpeech
+    from frequency import HeadwordCounter
+    from mecab_controller import MecabController
+
+R = TypeVar("R")
+
+_worker_mecab: Optional[MecabController] = None
+
+
+def _init_worker(controller_kwargs: dict[str, Any]) -> None:
+    global _worker_mecab
+    _worker_mecab = MecabController(**controller_kwargs)
+
+
+def _read_chunk(chunk: str) -> str:
+    """
+    Chunks travel between processes as one newline-separated string in each direction,
+    which is much cheaper to pickle than a list of strings.
+    Newlines inside an input don't matter because escape_text() replaces them anyway.
+    Readings never contain newlines.
+    """
+    return "\n".join(_worker_mecab.reading_many(chunk.split("\n")))
+
+
+def _count_chunk(chunk: str, parts_of_speech: Optional[Collection[PartOfSpeech]]) -> bytes:
+    counter = HeadwordCounter(parts_of_speech)
+    for tokens in _worker_mecab.translate_many(chunk.split("\n")):
+        counter.add_tokens(tokens)
+    return counter.to_bytes()
+
+
+def _chunks(exprs: Iterable[str], chunk_size: int) -> Iterator[str]:
+    it = iter(exprs)
+    while chunk := list(itertools.islice(it, chunk_size)):
+        yield "\n".join(expr.replace("\n", " ") for expr in chunk)
+
+
+def _map_chunks(
+    fn: Callable[..., R],
+    chunks: Iterable[str],
+    processes: Optional[int],
+    max_chunks_in_flight: Optional[int],
+    controller_kwargs: dict[str, Any],
+    *args,
+) -> Iterator[R]:
+    """
+    Runs fn(chunk, *args) for each chunk in a pool of processes and yields the results in input order.
+    The input is consumed lazily, at most max_chunks_in_flight chunks are queued at a time.
+    """
+    processes = processes or os.cpu_count() or 2
+    max_chunks_in_flight = max_chunks_in_flight or processes * 2
+    in_flight: collections.deque[AsyncResult] = collections.deque()
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(controller_kwargs,)) as pool:
+        for chunk in chunks:
+            in_flight.append(pool.apply_async(fn, (chunk, *args)))
+            if len(in_flight) >= max_chunks_in_flight:
+                yield in_flight.popleft().get()
+        while in_flight:
+            yield in_flight.popleft().get()
+
+
+def iter_readings(
+    exprs: Iterable[str],
+    processes: Optional[int] = None,
+    chunk_size: int = 256,
+    max_chunks_in_flight: Optional[int] = None,
+    **controller_kwargs,
+) -> Iterator[str]:
+    """
+    Yields reading(expr) for each input, in input order, computed by a pool of processes.
+    Each process owns its own MecabController, created with controller_kwargs.
+    """
+    chunks = _chunks(exprs, chunk_size)
+    for result in _map_chunks(_read_chunk, chunks, processes, max_chunks_in_flight, controller_kwargs):
+        yield from result.split("\n")
+
+
+def gil_enabled() -> bool:
+    """False on free-threaded Python running without the GIL."""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled() if is_gil_enabled else True
+
+
+def iter_readings_threaded(
+    exprs: Iterable[str],
+    threads: Optional[int] = None,
+    chunk_size: int = 256,
+    max_chunks_in_flight: Optional[int] = None,
+    **controller_kwargs,
+) -> Iterator[str]:
+    """
+    Like iter_readings(), but chunks are analyzed by a pool of threads sharing one MecabController.
+    Parsing and formatting only run on several cores at once on free-threaded Python (see gil_enabled()),
+    otherwise only the mecab processes run in parallel.
+    """
+    threads = threads or os.cpu_count() or 2
+    max_chunks_in_flight = max_chunks_in_flight or threads * 2
+    in_flight: collections.deque[Future] = collections.deque()
+    with MecabController(**controller_kwargs) as mecab:
+        with ThreadPoolExecutor(threads, thread_name_prefix="corpus") as executor:
+            for chunk in _chunks(exprs, chunk_size):
+                in_flight.append(executor.submit(mecab.reading_many, chunk.split("\n")))
+                if len(in_flight) >= max_chunks_in_flight:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+
+
+def count_headwords(
+    exprs: Iterable[str],
+    parts_of_speech: Optional[Collection[PartOfSpeech]] = None,
+    processes: Optional[int] = None,
+    chunk_size: int = 256,
+    max_chunks_in_flight: Optional[int] = None,
+    **controller_kwargs,
+) -> HeadwordCounter:
+    """
+    Counts (headword, part of speech) pairs in a corpus using a pool of processes.
+    The corpus is streamed, so it doesn't have to fit in memory. Only the counters do.
+    """
+    counter = HeadwordCounter(parts_of_speech)
+    chunks = _chunks(exprs, chunk_size)
+    for data in _map_chunks(_count_chunk, chunks, processes, max_chunks_in_flight, controller_kwargs, parts_of_speech):
+        counter.merge(HeadwordCounter.from_bytes(data))
+    return counter
+
+
+def main():
+    """
+    Compares the throughput of the Python stages (parsing, replace_mistakes, formatting) on one thread,
+    on a pool of threads and on a pool of processes. Mecab is replaced with recorded output, so that only Python runs.
+    Run it with a regular and a free-threaded build (e.g. python3.13 and python3.13t) to compare them.
+    """
+    import time
+
+    try:
+        from .basic_types import Separators
+        from .replay_backend import ReplayMecabController
+    except ImportError:
+        from basic_types import Separators
+        from replay_backend import ReplayMecabController
+
+    n_workers = max(2, os.cpu_count() or 2)
+    n_inputs = 20_000
+    records: dict[str, str] = {}
+
+    def make_inputs(tag: str) -> list[str]:
+        nodes = (
+            ("昨日", "昨日", "キノウ", "名詞", "*"),
+            ("すき焼き", "すき焼き", "スキヤキ", "名詞", "*"),
+            ("を", "を", "ヲ", "助詞", "*"),
+            ("食べ", "食べる", "タベ", "動詞", "連用形"),
+            ("まし", "ます", "マシ", "助動詞", "連用形"),
+            ("た", "た", "タ", "助動詞", "基本形"),
+        )
+        exprs = []
+        for idx in range(n_inputs):
+            expr = f"{tag}{idx}昨日すき焼きを食べました"
+            records[expr] = (
+                f"{tag}{idx}{Separators.node}"
+                + "".join(Separators.component.join(node) + Separators.node for node in nodes)
+                + Separators.footer
+            )
+            exprs.append(expr)
+        return exprs
+
+    runs = {
+        "1 thread": lambda exprs, kwargs: iter_readings_threaded(exprs, threads=1, **kwargs),
+        f"{n_workers} threads": lambda exprs, kwargs: iter_readings_threaded(exprs, threads=n_workers, **kwargs),
+        f"{n_workers} processes": lambda exprs, kwargs: iter_readings(exprs, processes=n_workers, **kwargs),
+    }
+    inputs = {name: make_inputs(f"r{run_idx}_") for run_idx, name in enumerate(runs)}
+    controller_kwargs = dict(backend=ReplayMecabController(records), cache_max_size=256)
+
+    print(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil_enabled() else 'disabled'}, {n_workers} cores")
+    for name, run in runs.items():
+        start = time.perf_counter()
+        results = list(run(inputs[name], controller_kwargs))
+        elapsed = time.perf_counter() - start
+        assert len(results) == n_inputs
+        assert results[0].endswith(" 昨日[きのう]すき 焼[や]きを 食[た]べました"), results[0]
+        print(f"{name:>12}: {n_inputs / elapsed:10.1f} inputs/s")
+
+
+if __name__ == "__main__":
+    main()
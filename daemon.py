@@ -0,0 +1,335 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+A local server that keeps warm mecab workers and one shared cache for several processes,
+and a thin client with the same translate/reading API as MecabController.
+
+Every frame starts with a fixed header followed by a utf-8 payload.
+Requests carry an id, so a client can send several requests before reading the responses (pipelining).
+Responses may arrive in a different order than the requests were sent.
+"""
+
+import argparse
+import enum
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
+
+try:
+    from .basic_types import Inflection, MecabParsedToken, PartOfSpeech
+    from .dispatcher import Priority
+    from .mecab_controller import MecabController
+    from .slow_calls import SlowCallTracer
+except ImportError:
+    from basic_types import Inflection, MecabParsedToken, PartOfSpeech
+    from dispatcher import Priority
+    from mecab_controller import MecabController
+    from slow_calls import SlowCallTracer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 28512
+REQUEST_HEADER = struct.Struct("<IIBB")  # payload length, request id, op, priority
+RESPONSE_HEADER = struct.Struct("<IIB")  # payload length, request id, status
+FIELD_LEN = struct.Struct("<I")
+Address = Union[str, tuple[str, int]]  # path to a unix socket or (host, port)
+
+
+class Op(enum.IntEnum):
+    translate = 1
+    reading = 2
+
+
+class Status(enum.IntEnum):
+    ok = 0
+    error = 1
+
+
+class DaemonError(RuntimeError):
+    """The server failed to handle a request."""
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        if not (n := sock.recv_into(view[received:])):
+            raise ConnectionError("connection closed.")
+        received += n
+    return bytes(buf)
+
+
+def encode_tokens(tokens: Iterable[MecabParsedToken]) -> bytes:
+    """Each field of each token is stored as a length-prefixed utf-8 string. None is stored as an empty string."""
+    out = bytearray()
+    for token in tokens:
+        for field in (
+            token.word,
+            token.headword,
+            token.katakana_reading,
+            token.part_of_speech.value,
+            token.inflection_type.value,
+        ):
+            data = (field or "").encode("utf-8")
+            out += FIELD_LEN.pack(len(data))
+            out += data
+    return bytes(out)
+
+
+def decode_tokens(payload: bytes) -> Sequence[MecabParsedToken]:
+    fields = []
+    pos = 0
+    while pos < len(payload):
+        (size,) = FIELD_LEN.unpack_from(payload, pos)
+        pos += FIELD_LEN.size
+        fields.append(payload[pos : pos + size].decode("utf-8"))
+        pos += size
+    return tuple(
+        MecabParsedToken(
+            word=word,
+            headword=headword,
+            katakana_reading=(katakana_reading or None),
+            part_of_speech=PartOfSpeech(part_of_speech or None),
+            inflection_type=Inflection(inflection or None),
+        )
+        for word, headword, katakana_reading, part_of_speech, inflection in zip(*[iter(fields)] * 5)
+    )
+
+
+def remove_stale_socket(path: str) -> None:
+    """
+    Removes a unix socket left behind by a server that is no longer running.
+    Raises FileExistsError if the path is something else, or if a server is still listening on it.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and isn't a socket.")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(path)
+    else:
+        raise FileExistsError(f"a server is already listening on {path}.")
+    finally:
+        probe.close()
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    server: "_ServerMixin"
+
+    def handle(self) -> None:
+        write_lock = threading.Lock()
+        while True:
+            try:
+                size, request_id, op, priority = REQUEST_HEADER.unpack(
+                    recv_exactly(self.request, REQUEST_HEADER.size)
+                )
+                expr = recv_exactly(self.request, size).decode("utf-8", "replace")
+            except ConnectionError:
+                return
+            try:
+                op, priority = Op(op), Priority(priority)
+            except ValueError as ex:
+                # The payload was read, so the connection can carry on with the next request.
+                self._send(write_lock, request_id, Status.error, str(ex).encode("utf-8"))
+                continue
+            self.server.executor.submit(self._respond, write_lock, request_id, op, expr, priority)
+
+    def _respond(self, write_lock: threading.Lock, request_id: int, op: Op, expr: str, priority: Priority) -> None:
+        mecab = self.server.mecab
+        try:
+            if op == Op.translate:
+                payload = encode_tokens(mecab.translate(expr, priority))
+            else:
+                payload = mecab.reading(expr, priority).encode("utf-8")
+            status = Status.ok
+        except Exception as ex:
+            payload = str(ex).encode("utf-8")
+            status = Status.error
+        self._send(write_lock, request_id, status, payload)
+
+    def _send(self, write_lock: threading.Lock, request_id: int, status: Status, payload: bytes) -> None:
+        with write_lock:
+            try:
+                self.request.sendall(RESPONSE_HEADER.pack(len(payload), request_id, status) + payload)
+            except OSError:
+                pass
+
+
+class _ServerMixin:
+    daemon_threads = True
+    allow_reuse_address = True
+    mecab: MecabController
+    executor: ThreadPoolExecutor
+
+
+class _TCPServer(_ServerMixin, socketserver.ThreadingTCPServer):
+    pass
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+
+    class _UnixServer(_ServerMixin, socketserver.ThreadingUnixStreamServer):
+        pass
+
+
+class MecabServer:
+    """
+    Serves translate/reading requests from a single MecabController,
+    so that every client shares its mecab workers and its cache.
+    """
+
+    _server: _ServerMixin
+
+    def __init__(self, address: Address, mecab: MecabController, max_concurrency: int = 8) -> None:
+        if isinstance(address, str):
+            remove_stale_socket(address)
+            self._server = _UnixServer(address, _RequestHandler)
+        else:
+            self._server = _TCPServer(address, _RequestHandler)
+        self._server.mecab = mecab
+        self._server.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="mecab_daemon")
+
+    @property
+    def address(self) -> Address:
+        return self._server.server_address
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def shutdown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._server.executor.shutdown()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class MecabClient:
+    """
+    Talks to MecabServer. Exposes the same translate/reading API as MecabController.
+    """
+
+    _sock: socket.socket
+    _lock: threading.Lock
+    _next_id: int
+
+    def __init__(self, address: Address = (DEFAULT_HOST, DEFAULT_PORT)) -> None:
+        if isinstance(address, str):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock.connect(address)
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def close(self) -> None:
+        self._sock.close()
+
+    def __enter__(self) -> "MecabClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def translate(self, expr: str, priority: Priority = Priority.interactive) -> Sequence[MecabParsedToken]:
+        return decode_tokens(self._request_many(Op.translate, (expr,), priority)[0])
+
+    def reading(self, expr: str, priority: Priority = Priority.interactive) -> str:
+        return self._request_many(Op.reading, (expr,), priority)[0].decode("utf-8")
+
+    def translate_many(
+        self, exprs: Iterable[str], priority: Priority = Priority.bulk
+    ) -> list[Sequence[MecabParsedToken]]:
+        """Sends all inputs at once and waits for the responses."""
+        return [decode_tokens(payload) for payload in self._request_many(Op.translate, exprs, priority)]
+
+    def reading_many(self, exprs: Iterable[str], priority: Priority = Priority.bulk) -> list[str]:
+        """Sends all inputs at once and waits for the responses."""
+        return [payload.decode("utf-8") for payload in self._request_many(Op.reading, exprs, priority)]
+
+    def _request_many(self, op: Op, exprs: Iterable[str], priority: Priority) -> list[bytes]:
+        with self._lock:
+            first_id = self._next_id
+            out = bytearray()
+            for expr in exprs:
+                data = expr.encode("utf-8")
+                out += REQUEST_HEADER.pack(len(data), self._next_id, op, priority)
+                out += data
+                self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+            n_requests = (self._next_id - first_id) & 0xFFFFFFFF
+            self._sock.sendall(out)
+            results: list[Optional[bytes]] = [None] * n_requests
+            errors = []
+            for _ in range(n_requests):
+                size, request_id, status = RESPONSE_HEADER.unpack(recv_exactly(self._sock, RESPONSE_HEADER.size))
+                payload = recv_exactly(self._sock, size)
+                if status != Status.ok:
+                    # Keep reading, otherwise the remaining responses would be left in the socket.
+                    errors.append(payload.decode("utf-8", "replace"))
+                results[(request_id - first_id) & 0xFFFFFFFF] = payload
+        if errors:
+            raise DaemonError(errors[0])
+        return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m mecab_controller serve",
+        description="Keep mecab warm and share one analysis cache between processes.",
+    )
+    parser.add_argument("--socket", help="listen on this unix socket instead of a TCP port")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="number of mecab workers")
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        help="start more workers (up to this many) when inputs queue up, stop them when they're idle",
+    )
+    parser.add_argument("--idle-timeout", type=float, default=30.0, help="seconds before an extra worker stops")
+    parser.add_argument("--cache-size", type=int, default=65536, help="number of cached analyses")
+    parser.add_argument("--compact-cache", action="store_true", help="store cached analyses zlib-compressed")
+    parser.add_argument("--backend", default="subprocess", help="subprocess, persistent, libmecab, fugashi or auto")
+    parser.add_argument("--trace-slow", type=float, help="record calls that take longer than this many seconds")
+    parser.add_argument("--trace-file", default="slow_calls.jsonl", help="where --trace-slow writes slow calls")
+    parser.add_argument("--digest-keys", action="store_true", help="cache analyses under digests of the inputs")
+    args = parser.parse_args(argv)
+
+    mecab = MecabController(
+        workers=args.workers,
+        max_workers=args.max_workers,
+        worker_idle_timeout=args.idle_timeout,
+        cache_max_size=args.cache_size,
+        compact_cache=args.compact_cache,
+        cache_compression=("zlib" if args.compact_cache else None),
+        digest_keys=args.digest_keys,
+        backend=args.backend,
+        tracer=(SlowCallTracer(args.trace_slow, path=args.trace_file) if args.trace_slow is not None else None),
+    )
+    max_concurrency = (args.max_workers or args.workers) * 2
+    server = MecabServer(args.socket or (args.host, args.port), mecab, max_concurrency=max_concurrency)
+    print("listening on", server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        mecab.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import collections
+import enum
+import itertools
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import NamedTuple, Optional
+
+MAX_SCALING_EVENTS = 256
+
+
+class Priority(enum.IntEnum):
+    """
+    Priority classes of inputs sent to mecab. Lower values are served first.
+    """
+
+    interactive = 0  # e.g. furigana generated while the user is editing a note.
+    bulk = 1  # e.g. "regenerate all notes".
+    idle = 2  # e.g. prefetching fields the user is about to view. Only run when nothing else is waiting.
+
+
+class ScalingEvent(NamedTuple):
+    timestamp: float  # unix time
+    kind: str  # "spawn" or "retire"
+    workers: int  # number of workers after the event
+    queue_depth: int
+
+
+class DispatcherStats(NamedTuple):
+    workers: int
+    idle_workers: int
+    peak_workers: int
+    queue_depth: int
+    spawned: int
+    retired: int
+    events: tuple[ScalingEvent, ...]  # most recent last
+
+
+class PriorityDispatcher:
+    """
+    Runs inputs on mecab worker threads.
+    Interactive inputs jump ahead of queued bulk work,
+    but bulk work is guaranteed at least `bulk_share` of the dispatched inputs so that it isn't starved.
+    Idle inputs are only picked when no interactive or bulk input is waiting.
+
+    `workers` threads are always kept. If max_workers is larger, a worker is added whenever
+    more inputs are queued than there are idle workers, and the extra workers exit
+    after waiting for `idle_timeout` seconds without work.
+    """
+
+    _run: Callable[[str], str]
+    _queues: dict[Priority, collections.deque[tuple[str, Future]]]
+    _bulk_share: float
+    _bulk_credit: float
+    _cond: threading.Condition
+    _workers: set[threading.Thread]
+    _min_workers: int
+    _max_workers: int
+    _idle_timeout: float
+    _idle_workers: int
+    _peak_workers: int
+    _spawned: int
+    _retired: int
+    _events: collections.deque[ScalingEvent]
+    _worker_ids: Callable[[], int]
+    _closed: bool
+
+    def __init__(
+        self,
+        run: Callable[[str], str],
+        workers: int = 2,
+        bulk_share: float = 0.25,
+        max_workers: Optional[int] = None,
+        idle_timeout: float = 30.0,
+    ) -> None:
+        if not 0 <= bulk_share <= 1:
+            raise ValueError("bulk share must be between 0 and 1.")
+        if max_workers is not None and max_workers < max(1, workers):
+            raise ValueError("max workers must be at least the number of workers and at least 1.")
+        self._run = run
+        self._queues = {priority: collections.deque() for priority in Priority}
+        self._bulk_share = bulk_share
+        self._bulk_credit = 0.0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._workers = set()
+        self._min_workers = workers
+        self._max_workers = max_workers or workers
+        self._idle_timeout = idle_timeout
+        self._idle_workers = 0
+        self._peak_workers = 0
+        self._spawned = 0
+        self._retired = 0
+        self._events = collections.deque(maxlen=MAX_SCALING_EVENTS)
+        self._worker_ids = itertools.count().__next__
+        with self._cond:
+            for _ in range(workers):
+                self._spawn_worker()
+
+    def submit(self, escaped: str, priority: Priority = Priority.interactive) -> str:
+        """Blocks until a worker has run mecab on this input and returns mecab's output."""
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("dispatcher is closed.")
+            self._queues[priority].append((escaped, future))
+            if self._queue_depth() > self._idle_workers and len(self._workers) < self._max_workers:
+                self._spawn_worker()
+            self._cond.notify()
+        return future.result()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return self._queue_depth()
+
+    def stats(self) -> DispatcherStats:
+        with self._cond:
+            return DispatcherStats(
+                workers=len(self._workers),
+                idle_workers=self._idle_workers,
+                peak_workers=self._peak_workers,
+                queue_depth=self._queue_depth(),
+                spawned=self._spawned,
+                retired=self._retired,
+                events=tuple(self._events),
+            )
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            workers = list(self._workers)
+        for worker in workers:
+            worker.join()
+
+    def _queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _spawn_worker(self) -> None:
+        """Must be called with the lock held."""
+        worker = threading.Thread(target=self._work_loop, name=f"mecab_worker_{self._worker_ids()}", daemon=True)
+        self._workers.add(worker)
+        self._spawned += 1
+        self._peak_workers = max(self._peak_workers, len(self._workers))
+        self._events.append(ScalingEvent(time.time(), "spawn", len(self._workers), self._queue_depth()))
+        worker.start()
+
+    def _retire_worker(self) -> None:
+        """Must be called with the lock held, from the worker that retires."""
+        self._workers.discard(threading.current_thread())
+        self._retired += 1
+        self._events.append(ScalingEvent(time.time(), "retire", len(self._workers), self._queue_depth()))
+
+    def _next_item(self) -> tuple[str, Future]:
+        """Pick the next input to run. Must be called with the lock held and with at least one queue non-empty."""
+        interactive, bulk = self._queues[Priority.interactive], self._queues[Priority.bulk]
+        if interactive and bulk:
+            self._bulk_credit += self._bulk_share
+            if self._bulk_credit >= 1:
+                self._bulk_credit -= 1
+                return bulk.popleft()
+            return interactive.popleft()
+        # Credit is only earned while bulk work is waiting behind interactive work.
+        self._bulk_credit = 0.0
+        return (interactive or bulk or self._queues[Priority.idle]).popleft()
+
+    def _has_work(self) -> bool:
+        return any(self._queues.values())
+
+    def _wait_for_work(self) -> bool:
+        """
+        Waits until there is work. Returns False if the worker should exit,
+        i.e. the dispatcher is closed or the worker is an extra one that has been idle for too long.
+        Must be called with the lock held.
+        """
+        self._idle_workers += 1
+        try:
+            while not (self._has_work() or self._closed):
+                timeout = self._idle_timeout if len(self._workers) > self._min_workers else None
+                timed_out = not self._cond.wait(timeout)
+                # Another worker may have retired in the meantime.
+                if timed_out and len(self._workers) > self._min_workers and not self._has_work():
+                    self._retire_worker()
+                    return False
+        finally:
+            self._idle_workers -= 1
+        return self._has_work()
+
+    def _work_loop(self) -> None:
+        while True:
+            with self._cond:
+                if not self._wait_for_work():
+                    return
+                escaped, future = self._next_item()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run(escaped))
+            except Exception as ex:
+                future.set_exception(ex)
+
+
+def main():
+    order = []
+
+    def run(expr: str) -> str:
+        time.sleep(0.01)
+        order.append(expr)
+        return expr
+
+    dispatcher = PriorityDispatcher(run, workers=1, bulk_share=0.25)
+    threads = [threading.Thread(target=dispatcher.submit, args=(f"p{idx}", Priority.idle)) for idx in range(4)]
+    threads += [threading.Thread(target=dispatcher.submit, args=(f"b{idx}", Priority.bulk)) for idx in range(8)]
+    threads += [threading.Thread(target=dispatcher.submit, args=(f"i{idx}", Priority.interactive)) for idx in range(8)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    dispatcher.close()
+    assert dispatcher.stats().events[0].kind == "spawn"
+    # Interactive inputs overtake queued bulk inputs, bulk still gets every fourth slot.
+    assert order.index("i7") < order.index("b7"), order
+    assert sum(expr.startswith("b") for expr in order[:13]) >= 3, order
+    # Idle inputs wait until everything else is done, except the one that was already running.
+    assert all(expr.startswith("p") for expr in order[-3:]), order
+    print(order)
+
+    # A burst grows the pool up to max_workers, the extra workers exit once they are idle.
+    dispatcher = PriorityDispatcher(run, workers=1, max_workers=4, idle_timeout=0.05)
+    threads = [threading.Thread(target=dispatcher.submit, args=(f"x{idx}",)) for idx in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert dispatcher.stats().peak_workers == 4, dispatcher.stats()
+    time.sleep(0.2)
+    stats = dispatcher.stats()
+    assert stats.workers == 1 and stats.retired == 3, stats
+    assert stats.events[-1].kind == "retire"
+    dispatcher.close()
+    print("Ok.")
+
+
+if __name__ == "__main__":
+    main()
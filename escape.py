@@ -0,0 +1,113 @@
+# Copyright: Ren Tatsumoto <tatsu at autistici.org> and contributors
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import re
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+
+ESCAPE_TABLE = str.maketrans({"\n": " ", "\uff5e": "~"})
+# HTML tags, [sound:...] tags and [[type:...]] fields. Matched in a single pass.
+RE_MARKUP = re.compile(r"<[^<>]+>|\[sound:[^]]+]|\[\[type:[^]]+]]")
+MARKUP_OPENERS = re.compile(r"[<\[]")
+MAX_MARKUP_LEN = 65536
+
+
+class Segment(NamedTuple):
+    text: str
+    is_markup: bool
+
+
+def escape_text(text: str) -> str:
+    """Strip characters that trip up mecab."""
+    return RE_MARKUP.sub("", text.translate(ESCAPE_TABLE)).strip()
+
+
+def escape_text_with_offsets(text: str) -> tuple[str, list[int]]:
+    """
+    Same as escape_text(), but also returns the offset in the original text of each character in the escaped text.
+    """
+    text = text.translate(ESCAPE_TABLE)
+    kept_text, offsets, pos = [], [], 0
+    for match in RE_MARKUP.finditer(text):
+        kept_text.append(text[pos : match.start()])
+        offsets.extend(range(pos, match.start()))
+        pos = match.end()
+    kept_text.append(text[pos:])
+    offsets.extend(range(pos, len(text)))
+    text = "".join(kept_text)
+    n_leading = len(text) - len(text.lstrip())
+    stripped = text.strip()
+    return stripped, offsets[n_leading : n_leading + len(stripped)]
+
+
+def split_markup(text: str) -> Iterator[Segment]:
+    """Split text into markup and text segments in a single pass."""
+    pos = 0
+    for match in RE_MARKUP.finditer(text):
+        if match.start() > pos:
+            yield Segment(text[pos : match.start()], False)
+        yield Segment(match.group(), True)
+        pos = match.end()
+    if pos < len(text):
+        yield Segment(text[pos:], False)
+
+
+def iter_markup_segments(chunks: Iterable[str]) -> Iterator[Segment]:
+    """
+    Like split_markup(), but for text that arrives in chunks, e.g. a large HTML field read from a file.
+    Markup split between chunks is put back together.
+    Text is held back until the next markup or line break, so that words aren't cut in half.
+    """
+    carry = ""
+    text = []
+    for chunk in chunks:
+        buf = carry + chunk
+        pos = 0
+        for match in RE_MARKUP.finditer(buf):
+            text.append(buf[pos : match.start()])
+            if any(text):
+                yield Segment("".join(text), False)
+            text.clear()
+            yield Segment(match.group(), True)
+            pos = match.end()
+        tail = buf[pos:]
+        # Anything from the first "<" or "[" after the last complete markup may be the start of unfinished markup.
+        if opener := MARKUP_OPENERS.search(tail):
+            cut = opener.start()
+            if len(tail) - cut > MAX_MARKUP_LEN:
+                # Too long to be markup.
+                cut = max(tail.rfind("<"), tail.rfind("["))
+        else:
+            cut = len(tail)
+        text.append(tail[:cut])
+        carry = tail[cut:]
+        if (line_end := text[-1].rfind("\n")) >= 0:
+            text[-1], rest = text[-1][: line_end + 1], text[-1][line_end + 1 :]
+            yield Segment("".join(text), False)
+            text = [rest]
+    yield from split_markup("".join(text) + carry)
+
+
+def main():
+    text = "<b>昨日</b>\n[sound:a.mp3]すき焼き～ "
+    escaped, offsets = escape_text_with_offsets(text)
+    assert escaped == escape_text(text) == "昨日 すき焼き~"
+    assert [text[offset] for offset in offsets] == list("昨日\nすき焼き～")
+    html = "<div class='x'>猫が</div>好き[sound:neko.mp3]です[[type:Front]]。a < b"
+    segments = list(split_markup(html))
+    assert "".join(segment.text for segment in segments) == html
+    assert [segment.text for segment in segments if segment.is_markup] == [
+        "<div class='x'>",
+        "</div>",
+        "[sound:neko.mp3]",
+        "[[type:Front]]",
+    ]
+    for size in (1, 2, 3, 7):
+        chunks = [html[idx : idx + size] for idx in range(0, len(html), size)]
+        assert [s for s in iter_markup_segments(chunks) if s.is_markup] == [s for s in segments if s.is_markup]
+        assert "".join(s.text for s in iter_markup_segments(chunks)) == html
+    print("Ok.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 # Copyright: Ren Tatsumoto <tatsu at autistici.org> and contributors
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
+import html
+from collections.abc import Iterable
+
 try:
-    from .compound_furigana import break_compound_furigana
+    from .basic_types import FuriganaSegment
+    from .compound_furigana import Dismembered, find_common_kana
     from .kana_conv import is_kana_char
 except ImportError:
-    from compound_furigana import break_compound_furigana
+    from basic_types import FuriganaSegment
+    from compound_furigana import Dismembered, find_common_kana
     from kana_conv import is_kana_char
 
 
@@ -27,23 +32,50 @@ def find_kanji_boundaries(word: str) -> tuple[int, int]:
     return len_kana_before, len_kana_after
 
 
-def format_output(kanji: str, reading: str) -> str:
-    """Convert (kanji, reading) input to output that Anki understands: kanji[reading]"""
-    # strip matching characters and beginning and end of reading and kanji
+def split_furigana(kanji: str, reading: str) -> list[FuriganaSegment]:
+    """
+    Split (kanji, reading) into segments, e.g. 取って置き, とっておき => 取[と], って, 置[お], き.
+    Kana at the beginning and end of the word get no reading. Compound words are broken up
+    at the kana they share with the reading, like break_compound_furigana() does.
+    """
     # reading should always be at least as long as the kanji
     n_before, n_after = find_kanji_boundaries(kanji)
-    if n_before == 0:
-        if n_after == 0:
-            out_expr = f" {kanji}[{reading}]"
-        else:
-            out_expr = f" {kanji[:-n_after]}[{reading[:-n_after]}]{kanji[-n_after:]}"
+    segments = []
+    if n_before:
+        segments.append(FuriganaSegment(kanji[:n_before], None))
+    if n_after:
+        word, word_reading, tail = kanji[n_before:-n_after], reading[n_before:-n_after], kanji[-n_after:]
     else:
-        if n_after == 0:
-            out_expr = f"{kanji[:n_before]} {kanji[n_before:]}[{reading[n_before:]}]"
-        else:
-            out_expr = f"{kanji[:n_before]} {kanji[n_before:-n_after]}[{reading[n_before:-n_after]}]{kanji[-n_after:]}"
+        word, word_reading, tail = kanji[n_before:], reading[n_before:], ""
+    while word and (split := find_common_kana(Dismembered(word, word_reading, ""))):
+        segments.append(FuriganaSegment(split.first.word, split.first.reading))
+        if split.first.tail:
+            segments.append(FuriganaSegment(split.first.tail, None))
+        word, word_reading = split.second.word, split.second.reading
+    segments.append(FuriganaSegment(word, word_reading))
+    if tail:
+        segments.append(FuriganaSegment(tail, None))
+    return segments
+
 
-    return break_compound_furigana(out_expr)
+def format_anki(segments: Iterable[FuriganaSegment]) -> str:
+    """Anki syntax: a space before each word with a reading, e.g. 野獣[やじゅう]の 様[よう]な"""
+    return "".join(base if ruby is None else f" {base}[{ruby}]" for base, ruby in segments)
+
+
+def format_html(segments: Iterable[FuriganaSegment]) -> str:
+    """HTML ruby, e.g. <ruby>野獣<rt>やじゅう</rt></ruby>の"""
+    return "".join(
+        html.escape(base, quote=False)
+        if ruby is None
+        else f"<ruby>{html.escape(base, quote=False)}<rt>{html.escape(ruby, quote=False)}</rt></ruby>"
+        for base, ruby in segments
+    )
+
+
+def format_output(kanji: str, reading: str) -> str:
+    """Convert (kanji, reading) input to output that Anki understands: kanji[reading]"""
+    return format_anki(split_furigana(kanji, reading))
 
 
 if __name__ == "__main__":
@@ -67,4 +99,8 @@ if __name__ == "__main__":
     assert format_output("今は", "いまわ") == " 今[いま]は"
     assert format_output("ほほ笑む", "ほおえむ") == "ほほ 笑[え]む"
     assert format_output("ほほ笑む", "ほほえむ") == "ほほ 笑[え]む"
+    assert format_html(split_furigana("取って置き", "とっておき")) == (
+        "<ruby>取<rt>と</rt></ruby>って<ruby>置<rt>お</rt></ruby>き"
+    )
+    assert format_html([FuriganaSegment("<b>", None)]) == "&lt;b&gt;"
     print("2 Done.")
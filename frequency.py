@@ -0,0 +1,146 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import array
+import struct
+from collections.abc import Collection, Iterable
+from typing import NamedTuple, Optional
+
+try:
+    from .basic_types import MecabParsedToken, PartOfSpeech
+except ImportError:
+    from basic_types import MecabParsedToken, PartOfSpeech
+
+POS_CODES: tuple[PartOfSpeech, ...] = tuple(PartOfSpeech)
+POS_TO_CODE: dict[PartOfSpeech, int] = {pos: code for code, pos in enumerate(POS_CODES)}
+HEADER = struct.Struct("<4sI")  # magic, number of entries
+MAGIC = b"AJTF"
+
+
+class HeadwordCount(NamedTuple):
+    headword: str
+    part_of_speech: PartOfSpeech
+    count: int
+
+
+class HeadwordCounter:
+    """
+    Counts (headword, part of speech) pairs.
+    Each distinct pair gets an integer id, and the counts are stored in a flat array indexed by that id,
+    so memory grows with the vocabulary, not with the size of the corpus.
+    Counters from different workers or processes can be merged.
+    """
+
+    _ids: dict[tuple[str, PartOfSpeech], int]
+    _keys: list[tuple[str, PartOfSpeech]]
+    _counts: array.array
+    _parts_of_speech: Optional[frozenset[PartOfSpeech]]
+
+    def __init__(self, parts_of_speech: Optional[Collection[PartOfSpeech]] = None) -> None:
+        """If parts_of_speech is given, tokens with other parts of speech aren't counted."""
+        self._ids = {}
+        self._keys = []
+        self._counts = array.array("Q")
+        self._parts_of_speech = frozenset(parts_of_speech) if parts_of_speech is not None else None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def total(self) -> int:
+        return sum(self._counts)
+
+    def _id_of(self, key: tuple[str, PartOfSpeech]) -> int:
+        try:
+            return self._ids[key]
+        except KeyError:
+            self._ids[key] = key_id = len(self._keys)
+            self._keys.append(key)
+            self._counts.append(0)
+            return key_id
+
+    def add(self, headword: str, part_of_speech: PartOfSpeech, count: int = 1) -> None:
+        if self._parts_of_speech is None or part_of_speech in self._parts_of_speech:
+            self._counts[self._id_of((headword, part_of_speech))] += count
+
+    def add_tokens(self, tokens: Iterable[MecabParsedToken]) -> None:
+        for token in tokens:
+            self.add(token.headword, token.part_of_speech)
+
+    def merge(self, other: "HeadwordCounter") -> None:
+        for (headword, part_of_speech), count in zip(other._keys, other._counts):
+            self.add(headword, part_of_speech, count)
+
+    def most_common(
+        self,
+        n: Optional[int] = None,
+        parts_of_speech: Optional[Collection[PartOfSpeech]] = None,
+    ) -> list[HeadwordCount]:
+        """Top-n pairs, most frequent first. Optionally only the given parts of speech."""
+        ids = range(len(self._keys))
+        if parts_of_speech is not None:
+            ids = [key_id for key_id in ids if self._keys[key_id][1] in parts_of_speech]
+        ranked = sorted(ids, key=self._counts.__getitem__, reverse=True)
+        return [HeadwordCount(*self._keys[key_id], self._counts[key_id]) for key_id in ranked[:n]]
+
+    def to_bytes(self) -> bytes:
+        """
+        Compact form used to send counters between processes and to save them to disk:
+        a header, the counts, one byte per part of speech, and the NUL-separated headwords.
+        """
+        return b"".join(
+            (
+                HEADER.pack(MAGIC, len(self._keys)),
+                self._counts.tobytes(),
+                bytes(POS_TO_CODE[pos] for _, pos in self._keys),
+                "\0".join(headword for headword, _ in self._keys).encode("utf-8"),
+            )
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HeadwordCounter":
+        magic, n_entries = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not a headword counter.")
+        pos = HEADER.size
+        counts = array.array("Q")
+        counts.frombytes(data[pos : pos + n_entries * counts.itemsize])
+        pos += n_entries * counts.itemsize
+        codes = data[pos : pos + n_entries]
+        pos += n_entries
+        headwords = data[pos:].decode("utf-8").split("\0") if n_entries else []
+        counter = cls()
+        counter._keys = [(headword, POS_CODES[code]) for headword, code in zip(headwords, codes)]
+        counter._ids = {key: key_id for key_id, key in enumerate(counter._keys)}
+        counter._counts = counts
+        return counter
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> "HeadwordCounter":
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+def main():
+    counter = HeadwordCounter()
+    counter.add("食べる", PartOfSpeech.verb)
+    counter.add("食べる", PartOfSpeech.verb)
+    counter.add("は", PartOfSpeech.particle)
+    other = HeadwordCounter(parts_of_speech=[PartOfSpeech.noun])
+    other.add("猫", PartOfSpeech.noun, 5)
+    other.add("を", PartOfSpeech.particle)
+    counter.merge(other)
+    assert counter.most_common(1) == [HeadwordCount("猫", PartOfSpeech.noun, 5)]
+    assert counter.most_common(parts_of_speech=[PartOfSpeech.verb]) == [HeadwordCount("食べる", PartOfSpeech.verb, 2)]
+    assert counter.total() == 8
+    restored = HeadwordCounter.from_bytes(counter.to_bytes())
+    assert restored.most_common() == counter.most_common()
+    assert len(HeadwordCounter.from_bytes(HeadwordCounter().to_bytes())) == 0
+    print("Ok.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+A fast in-process reader that doesn't need mecab.
+It uses KAKASI's dictionaries bundled in the "support" dir and picks the longest dictionary entry at each position.
+The result is worse than mecab's analysis, but it's available when mecab can't start or is overloaded.
+"""
+
+import mmap
+import os
+import struct
+import threading
+from collections.abc import Iterable, Sequence
+from typing import NamedTuple, Optional
+
+try:
+    from .basic_types import Inflection, MecabParsedToken, PartOfSpeech
+    from .escape import escape_text
+    from .kana_conv import is_kana_char, to_katakana
+    from .mecab_controller import format_reading
+    from .mecab_exe_finder import SUPPORT_DIR
+except ImportError:
+    from basic_types import Inflection, MecabParsedToken, PartOfSpeech
+    from escape import escape_text
+    from kana_conv import is_kana_char, to_katakana
+    from mecab_controller import format_reading
+    from mecab_exe_finder import SUPPORT_DIR
+
+KANWADICT_PATH = os.path.join(SUPPORT_DIR, "kanwadict")
+ITAIJIDICT_PATH = os.path.join(SUPPORT_DIR, "itaijidict")
+DICT_ENCODING = "euc_jp"
+
+# kanwadict starts with a table of (offset, number of entries) for every two-byte EUC-JP character.
+# Each entry is: okurigana class (0 if none), length of the word without the first character,
+# the word without the first character, length of the reading, the reading.
+INDEX_ROW_SIZE = 0x60
+INDEX_ITEM = struct.Struct("<ii")
+
+# Kana that may follow a word with the given okurigana class.
+OKURIGANA_CLASSES = {
+    "a": "あぁ",
+    "i": "いぃ",
+    "u": "うぅ",
+    "e": "えぇ",
+    "o": "おぉ",
+    "k": "かきくけこ",
+    "g": "がぎぐげご",
+    "s": "さしすせそ",
+    "z": "ざじずぜぞ",
+    "j": "じ",
+    "t": "たちつてとっ",
+    "c": "ち",
+    "d": "だぢづでど",
+    "n": "なにぬねのん",
+    "h": "はひふへほ",
+    "b": "ばびぶべぼ",
+    "p": "ぱぴぷぺぽ",
+    "m": "まみむめも",
+    "y": "やゆよゃゅょ",
+    "r": "らりるれろ",
+    "w": "わゐゑを",
+}
+
+
+class DictEntry(NamedTuple):
+    tail: str  # the word without its first character
+    reading: str  # hiragana
+    okurigana: str  # kana that must follow the word, empty if anything can follow
+
+
+def load_itaiji_table(path: str = ITAIJIDICT_PATH) -> dict[int, str]:
+    """itaijidict maps variant kanji to their standard forms, one pair per line."""
+    table = {}
+    with open(path, encoding=DICT_ENCODING, errors="ignore") as f:
+        for line in f:
+            if len(line := line.strip()) == 2:
+                table[ord(line[0])] = line[1]
+    return table
+
+
+class KakasiReader:
+    """
+    Longest-match reader over kanwadict.
+    The dictionary file is memory-mapped, and the entries for a character are decoded
+    the first time the character is looked up. Has the same translate/reading API as MecabController.
+    """
+
+    _mm: mmap.mmap
+    _variants: dict[int, str]
+    _buckets: dict[str, tuple[DictEntry, ...]]
+    _lock: threading.Lock
+
+    def __init__(self, kanwadict_path: str = KANWADICT_PATH, itaijidict_path: str = ITAIJIDICT_PATH) -> None:
+        with open(kanwadict_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._variants = load_itaiji_table(itaijidict_path)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _entries(self, char: str) -> tuple[DictEntry, ...]:
+        """Dictionary entries starting with char, longest first."""
+        try:
+            return self._buckets[char]
+        except KeyError:
+            pass
+        entries = self._decode_bucket(char)
+        with self._lock:
+            return self._buckets.setdefault(char, entries)
+
+    def _decode_bucket(self, char: str) -> tuple[DictEntry, ...]:
+        try:
+            hi, lo = char.encode(DICT_ENCODING)
+        except (UnicodeEncodeError, ValueError):
+            return ()
+        if hi < 0xA0 or lo < 0xA0:
+            return ()
+        offset, count = INDEX_ITEM.unpack_from(self._mm, ((hi - 0xA0) * INDEX_ROW_SIZE + (lo - 0xA0)) * INDEX_ITEM.size)
+        entries = []
+        for _ in range(count):
+            okurigana_class, tail_len = self._mm[offset], self._mm[offset + 1]
+            tail = self._mm[offset + 2 : offset + 2 + tail_len]
+            reading_len = self._mm[offset + 2 + tail_len]
+            reading = self._mm[offset + 3 + tail_len : offset + 3 + tail_len + reading_len]
+            offset += 3 + tail_len + reading_len
+            entries.append(
+                DictEntry(
+                    tail=tail.decode(DICT_ENCODING, "replace"),
+                    reading=reading.decode(DICT_ENCODING, "replace"),
+                    okurigana=(OKURIGANA_CLASSES.get(chr(okurigana_class), "") if okurigana_class else ""),
+                )
+            )
+        # Longer words first. Among words of the same length, try the ones that require okurigana first.
+        entries.sort(key=lambda entry: (len(entry.tail), bool(entry.okurigana)), reverse=True)
+        return tuple(entries)
+
+    def _match(self, normalized: str, pos: int) -> tuple[int, str]:
+        """Returns the length and the reading of the longest word starting at pos, or (0, "")."""
+        for entry in self._entries(normalized[pos]):
+            end = pos + 1 + len(entry.tail)
+            if not normalized.startswith(entry.tail, pos + 1):
+                continue
+            if entry.okurigana and (end >= len(normalized) or normalized[end] not in entry.okurigana):
+                continue
+            return end - pos, entry.reading
+        return 0, ""
+
+    def _iter_tokens(self, text: str) -> Iterable[MecabParsedToken]:
+        normalized = text.translate(self._variants)
+        pos = plain_start = 0
+        while pos < len(normalized):
+            length, reading = (0, "") if is_kana_char(normalized[pos]) else self._match(normalized, pos)
+            if not length:
+                pos += 1
+                continue
+            if plain_start < pos:
+                yield make_token(text[plain_start:pos])
+            yield make_token(text[pos : pos + length], to_katakana(reading))
+            pos += length
+            plain_start = pos
+        if plain_start < len(text):
+            yield make_token(text[plain_start:])
+
+    def translate(self, expr: str) -> Sequence[MecabParsedToken]:
+        return tuple(self._iter_tokens(escape_text(expr)))
+
+    def reading(self, expr: str) -> str:
+        return format_reading(self.translate(expr))
+
+
+def make_token(word: str, katakana_reading: Optional[str] = None) -> MecabParsedToken:
+    return MecabParsedToken(
+        word=word,
+        headword=word,
+        katakana_reading=katakana_reading,
+        part_of_speech=PartOfSpeech.unknown,
+        inflection_type=Inflection.unknown,
+    )
+
+
+def main():
+    import time
+
+    try:
+        from .basic_mecab_controller import MecabError, MecabStartError
+        from .dispatcher import Priority
+        from .mecab_controller import MecabController
+    except ImportError:
+        from basic_mecab_controller import MecabError, MecabStartError
+        from dispatcher import Priority
+        from mecab_controller import MecabController
+
+    reader = KakasiReader()
+    assert reader.reading("哀れな猫") == " 哀[あわ]れな 猫[ねこ]", reader.reading("哀れな猫")
+    assert reader.reading("愛しい") == " 愛[いと]しい"
+    assert reader.reading("Lorem ipsum") == "Lorem ipsum"
+
+    try_expressions = (
+        "カリン、自分でまいた種は自分で刈り取れ",
+        "昨日、林檎を2個買った。",
+        "詳細はお気軽にお問い合わせ下さい。",
+        "粗末な家に住んでいる",
+        "一人暮らし",
+    )
+    for expr in try_expressions:
+        print(reader.reading(expr))
+
+    # Throughput compared to the mecab path. The cache is bypassed to measure the analysis itself.
+    n_rounds = 200
+    start = time.perf_counter()
+    for _ in range(n_rounds):
+        for expr in try_expressions:
+            format_reading(reader._iter_tokens(escape_text(expr)))
+    kakasi_elapsed = time.perf_counter() - start
+    print(f"kakasi: {n_rounds * len(try_expressions) / kakasi_elapsed:.1f} inputs/s")
+
+    # mecab can't be started: the reader is used instead. It's not the input's fault, so it isn't remembered.
+    missing_cmd = [os.path.join(SUPPORT_DIR, "no_such_mecab")]
+    missing = MecabController(mecab_cmd=missing_cmd, fallback_reader=reader.translate)
+    assert missing.reading("哀れな猫") == reader.reading("哀れな猫")
+    assert missing.reading("哀れな猫") == reader.reading("哀れな猫")
+    assert escape_text("哀れな猫") not in missing._failures
+    assert isinstance(missing.last_error, MecabStartError)
+    # Without a reader, the error is raised instead of silently returning text without furigana.
+    try:
+        MecabController(mecab_cmd=missing_cmd).reading("哀れな猫")
+    except MecabStartError:
+        pass
+    else:
+        raise AssertionError("MecabStartError wasn't raised.")
+
+    mecab = MecabController()
+    start = time.perf_counter()
+    try:
+        for expr in try_expressions:
+            format_reading(mecab._translate(escape_text(expr), Priority.interactive))
+    except MecabError as ex:
+        print(f"mecab: unavailable ({ex})")
+    else:
+        mecab_elapsed = time.perf_counter() - start
+        print(f"mecab: {len(try_expressions) / mecab_elapsed:.1f} inputs/s")
+
+
+if __name__ == "__main__":
+    main()
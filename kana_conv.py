@@ -2,6 +2,7 @@
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
 import re
+from collections.abc import Iterable
 
 # Define characters
 HIRAGANA = "ぁあぃいぅうぇえぉおかがか゚きぎき゚くぐく゚けげけ゚こごこ゚さざしじすずせぜそぞただちぢっつづてでとどなにぬねのはばぱひびぴふぶぷへべぺほぼぽまみむめもゃやゅゆょよらりるれろゎわゐゑをんゔゕゖゝゞ"
@@ -13,11 +14,60 @@ HIRAGANA_TO_KATAKANA = str.maketrans(HIRAGANA, KATAKANA)
 
 RE_ONE_MORA = re.compile(r".゚?[ァィゥェォャュョぁぃぅぇぉゃゅょ]?")
 
+# Tables for the mora segmenter below. It splits text the same way as RE_ONE_MORA.
+SMALL_KANA = frozenset("ァィゥェォャュョぁぃぅぇぉゃゅょ")
+SEMI_VOICED_MARK = "゚"
+# Deletes characters that never start a mora unless they follow another such character.
+DROP_ATTACHED = str.maketrans(dict.fromkeys((*SMALL_KANA, SEMI_VOICED_MARK)))
+# Places where a small kana or the mark starts a mora of its own. Readings without them can be counted in one pass.
+RE_IRREGULAR = re.compile(
+    r"^[゚ァィゥェォャュョぁぃぅぇぉゃゅょ]"
+    r"|[\n゚ァィゥェォャュョぁぃぅぇぉゃゅょ]゚"
+    r"|[\nァィゥェォャュョぁぃぅぇぉゃゅょ]{2}"
+)
+
 
 def kana_to_moras(kana: str) -> list[str]:
     return re.findall(RE_ONE_MORA, kana)
 
 
+def mora_offsets(kana: str) -> list[int]:
+    """Offsets at which each mora of kana_to_moras(kana) starts, without creating the substrings."""
+    offsets = []
+    attach = 0  # what can join the current mora: 0 nothing, 1 the mark or a small kana, 2 a small kana
+    for idx, char in enumerate(kana):
+        if char == "\n":
+            # Not matched by RE_ONE_MORA.
+            attach = 0
+        elif attach and char in SMALL_KANA:
+            attach = 0
+        elif attach == 1 and char == SEMI_VOICED_MARK:
+            attach = 2
+        else:
+            offsets.append(idx)
+            attach = 1
+    return offsets
+
+
+def mora_count(kana: str) -> int:
+    """Same as len(kana_to_moras(kana))."""
+    if "\n" in kana or RE_IRREGULAR.search(kana):
+        return len(mora_offsets(kana))
+    return len(kana.translate(DROP_ATTACHED))
+
+
+def mora_counts(readings: Iterable[str]) -> list[int]:
+    """Mora counts of many readings, faster than calling mora_count() on each one."""
+    readings = list(readings)
+    if not readings:
+        return []
+    joined = "\n".join(readings)
+    if joined.count("\n") != len(readings) - 1 or RE_IRREGULAR.search(joined):
+        return [mora_count(reading) for reading in readings]
+    # Readings are separated by a line break, which can't be part of a mora.
+    return [len(part) for part in joined.translate(DROP_ATTACHED).split("\n")]
+
+
 def to_hiragana(kana: str) -> str:
     return kana.translate(KATAKANA_TO_HIRAGANA)
 
@@ -73,8 +123,42 @@ def main():
     assert is_kana_str("ひらがなカタカナ") is True
     assert is_kana_str("ニュース") is True
     assert is_kana_str("故郷は") is False
+    for kana in (
+        "",
+        "ニュース",
+        "きゃっか゚ゅ",
+        "ゃゃゃ",
+        "か゚゚ゅゅ",
+        "ー゚ょ",
+        "しゃ\nゅき",
+        "\n\n゚",
+        "東京ディズニーランド",
+        "a゚ぁb",
+    ):
+        moras = kana_to_moras(kana)
+        assert mora_offsets(kana) == [m.start() for m in RE_ONE_MORA.finditer(kana)], kana
+        assert mora_count(kana) == len(moras), kana
+    readings = ["きょう", "がっこう", "ちゃ\nちゃ", "", "ぴゃ゚", "ゅう", "ディズニーランド"]
+    assert mora_counts(readings) == [len(kana_to_moras(reading)) for reading in readings]
+    assert mora_counts(readings[:2]) == [2, 4]
+    benchmark_moras()
     print("Ok.")
 
 
+def benchmark_moras():
+    import timeit
+
+    words = ("がっこう", "きょう", "ちゅうしゃじょう", "ディズニーランド", "か゚", "とうきょう", "ニュース", "いく")
+    readings = [words[idx % len(words)] for idx in range(50_000)]
+    for name, fn in (
+        ("regex count", lambda: [len(kana_to_moras(reading)) for reading in readings]),
+        ("table count", lambda: [mora_count(reading) for reading in readings]),
+        ("bulk count", lambda: mora_counts(readings)),
+        ("regex offsets", lambda: [[m.start() for m in RE_ONE_MORA.finditer(r)] for r in readings]),
+        ("table offsets", lambda: [mora_offsets(reading) for reading in readings]),
+    ):
+        print(f"{name}: {min(timeit.repeat(fn, number=1, repeat=3)) * 1000:.1f} ms")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,449 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Drive MecabController (or a shared daemon) with many concurrent clients and report latency over time, e.g.
+
+    python -m mecab_controller load-test --mode threads --clients 32 --duration 30 --workers 4 corpus.txt
+
+Clients are threads, asyncio tasks, or processes. Each client sends requests back to back
+(optionally with a pause between them) until the test ends.
+"""
+
+import argparse
+import asyncio
+import collections
+import dataclasses
+import json
+import math
+import multiprocessing
+import random
+import threading
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+try:
+    from .daemon import Address, MecabClient
+    from .lru_cache import CacheStats
+    from .mecab_controller import MecabController
+except ImportError:
+    from daemon import Address, MecabClient
+    from lru_cache import CacheStats
+    from mecab_controller import MecabController
+
+MODES = ("threads", "asyncio", "processes")
+OPS = ("translate", "reading")
+SAMPLE_TEXT = (
+    "カリン、自分でまいた種は自分で刈り取れ。昨日、林檎を2個買った。"
+    "詳細はお気軽にお問い合わせ下さい。粗末な家に住んでいる。向けていた目。"
+    "軽そうに見える。放っておけない。プールから出て一人暮らしを始めた。"
+)
+
+# (time the request finished, latency in seconds, whether it raised)
+Sample = tuple[float, float, bool]
+
+
+@dataclasses.dataclass
+class LoadConfig:
+    mode: str = "threads"
+    clients: int = 8
+    duration: float = 10.0
+    interval: float = 1.0  # length of each reported window, in seconds
+    slo: float = 0.5  # requests slower than this count as timeouts
+    think_time: float = 0.0  # pause between the requests of one client
+    mix: dict[str, float] = dataclasses.field(default_factory=lambda: {"reading": 3.0, "translate": 1.0})
+    mean_length: float = 30.0  # input lengths are log-normally distributed around this many characters
+    length_sigma: float = 0.8
+    repeat: float = 0.3  # share of inputs that repeat an earlier input, i.e. can be cache hits
+    seed: int = 0
+    corpus_path: Optional[str] = None  # inputs are cut out of this text. SAMPLE_TEXT is used if not set.
+    daemon: Optional[Address] = None  # talk to a running daemon instead of a local MecabController
+    controller_kwargs: dict[str, Any] = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class WindowStats:
+    start: float  # seconds since the test started
+    requests: int
+    throughput: float  # requests per second
+    p50: float
+    p95: float
+    p99: float
+    max: float
+    timeouts: int
+    errors: int
+    hit_ratio: Optional[float]  # None if the cache can't be observed, e.g. behind a daemon
+
+
+@dataclasses.dataclass
+class LoadReport:
+    windows: list[WindowStats]
+    total: WindowStats
+
+
+class InputGenerator:
+    """
+    Cuts inputs with log-normally distributed lengths out of a corpus.
+    A share of the inputs repeats one of the recent inputs.
+    """
+
+    def __init__(self, corpus: str, config: LoadConfig, seed: int) -> None:
+        self._corpus = corpus.replace("\n", "")
+        self._config = config
+        self._rng = random.Random(seed)
+        self._recent: collections.deque[str] = collections.deque(maxlen=1000)
+
+    def __call__(self) -> str:
+        if self._recent and self._rng.random() < self._config.repeat:
+            return self._rng.choice(self._recent)
+        length = max(1, int(self._rng.lognormvariate(math.log(self._config.mean_length), self._config.length_sigma)))
+        start = self._rng.randrange(len(self._corpus))
+        expr = (self._corpus * (1 + length // len(self._corpus) + 1))[start : start + length]
+        self._recent.append(expr)
+        return expr
+
+
+def read_corpus(config: LoadConfig) -> str:
+    if config.corpus_path is None:
+        return SAMPLE_TEXT
+    with open(config.corpus_path, encoding="utf-8") as f:
+        return f.read()
+
+
+def make_target(config: LoadConfig):
+    if config.daemon is not None:
+        return MecabClient(config.daemon)
+    mecab = MecabController(**config.controller_kwargs)
+    mecab.warm_up().wait()
+    return mecab
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))]
+
+
+class Client:
+    """Sends requests to a target until the deadline and records a sample for each."""
+
+    def __init__(self, target, corpus: str, config: LoadConfig, seed: int) -> None:
+        self._target = target
+        self._config = config
+        self._next_input = InputGenerator(corpus, config, seed)
+        self._rng = random.Random(seed)
+        self._ops = list(config.mix)
+        self._weights = list(config.mix.values())
+        self.samples: list[Sample] = []
+
+    def next_request(self) -> tuple[Callable[[str], Any], str]:
+        op = self._rng.choices(self._ops, self._weights)[0]
+        return getattr(self._target, op), self._next_input()
+
+    def run(self, deadline: float) -> list[Sample]:
+        while time.time() < deadline:
+            fn, expr = self.next_request()
+            start = time.perf_counter()
+            try:
+                fn(expr)
+            except Exception:
+                failed = True
+            else:
+                failed = False
+            self.samples.append((time.time(), time.perf_counter() - start, failed))
+            if self._config.think_time:
+                time.sleep(self._config.think_time)
+        return self.samples
+
+    async def run_async(self, deadline: float, executor: ThreadPoolExecutor) -> list[Sample]:
+        loop = asyncio.get_running_loop()
+        while time.time() < deadline:
+            fn, expr = self.next_request()
+            start = time.perf_counter()
+            try:
+                await loop.run_in_executor(executor, fn, expr)
+            except Exception:
+                failed = True
+            else:
+                failed = False
+            self.samples.append((time.time(), time.perf_counter() - start, failed))
+            if self._config.think_time:
+                await asyncio.sleep(self._config.think_time)
+        return self.samples
+
+
+class CacheSampler:
+    """Records the target's cache stats at the start of every window and at the end of the test."""
+
+    def __init__(self, target, start: float, deadline: float, interval: float) -> None:
+        self.snapshots: list[CacheStats] = []
+        self._thread = None
+        if hasattr(target, "cache_stats"):
+            self._thread = threading.Thread(
+                target=self._run, args=(target, start, deadline, interval), name="load_test_sampler", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, target, start: float, deadline: float, interval: float) -> None:
+        boundary = start
+        while True:
+            time.sleep(max(0.0, boundary - time.time()))
+            self.snapshots.append(target.cache_stats())
+            if boundary >= deadline:
+                return
+            boundary = min(boundary + interval, deadline)
+
+    def join(self) -> list[CacheStats]:
+        if self._thread:
+            self._thread.join()
+        return self.snapshots
+
+
+def _make_clients(config: LoadConfig, corpus: str) -> tuple[Optional[MecabController], list[Client]]:
+    """A local controller is shared by all clients. A daemon gets one connection per client."""
+    if config.daemon is not None:
+        return None, [
+            Client(make_target(config), corpus, config, seed=config.seed + idx) for idx in range(config.clients)
+        ]
+    shared = make_target(config)
+    return shared, [Client(shared, corpus, config, seed=config.seed + idx) for idx in range(config.clients)]
+
+
+def _close_targets(shared: Optional[MecabController], clients: Sequence[Client]) -> None:
+    """Stops the shared controller's threads, or closes each client's connection to the daemon."""
+    for target in [shared] if shared is not None else [client._target for client in clients]:
+        target.close()
+
+
+def _run_threads(config: LoadConfig, corpus: str) -> tuple[float, list[Sample], list[list[CacheStats]]]:
+    shared, clients = _make_clients(config, corpus)
+    start = time.time()
+    deadline = start + config.duration
+    sampler = CacheSampler(shared, start, deadline, config.interval)
+    try:
+        with ThreadPoolExecutor(config.clients) as executor:
+            results = list(executor.map(lambda client: client.run(deadline), clients))
+    finally:
+        _close_targets(shared, clients)
+    return start, [sample for samples in results for sample in samples], [sampler.join()]
+
+
+def _run_asyncio(config: LoadConfig, corpus: str) -> tuple[float, list[Sample], list[list[CacheStats]]]:
+    shared, clients = _make_clients(config, corpus)
+
+    async def run_all(deadline: float) -> list[list[Sample]]:
+        with ThreadPoolExecutor(config.clients) as executor:
+            return await asyncio.gather(*(client.run_async(deadline, executor) for client in clients))
+
+    start = time.time()
+    deadline = start + config.duration
+    sampler = CacheSampler(shared, start, deadline, config.interval)
+    try:
+        results = asyncio.run(run_all(deadline))
+    finally:
+        _close_targets(shared, clients)
+    return start, [sample for samples in results for sample in samples], [sampler.join()]
+
+
+def _process_client(config: LoadConfig, idx: int, barrier, results) -> None:
+    target = make_target(config)
+    client = Client(target, read_corpus(config), config, seed=config.seed + idx)
+    barrier.wait()
+    start = time.time()
+    deadline = start + config.duration
+    sampler = CacheSampler(target, start, deadline, config.interval)
+    try:
+        results.put((start, client.run(deadline), sampler.join()))
+    finally:
+        target.close()
+
+
+def _run_processes(config: LoadConfig, corpus: str) -> tuple[float, list[Sample], list[list[CacheStats]]]:
+    """Each process has its own MecabController (and its own cache), or its own connection to the daemon."""
+    barrier = multiprocessing.Barrier(config.clients + 1)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_process_client, args=(config, idx, barrier, results), daemon=True)
+        for idx in range(config.clients)
+    ]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    start = time.time()
+    samples, snapshots = [], []
+    for _ in processes:
+        _, process_samples, process_snapshots = results.get()
+        samples.extend(process_samples)
+        snapshots.append(process_snapshots)
+    for process in processes:
+        process.join()
+    return start, samples, snapshots
+
+
+def summarize(
+    start: float,
+    duration: float,
+    samples: Sequence[Sample],
+    hits: Optional[CacheStats],
+    slo: float,
+) -> WindowStats:
+    latencies = sorted(latency for _, latency, _ in samples)
+    return WindowStats(
+        start=start,
+        requests=len(samples),
+        throughput=len(samples) / max(duration, 1e-9),
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+        max=(latencies[-1] if latencies else 0.0),
+        timeouts=sum(latency > slo for latency in latencies),
+        errors=sum(failed for _, _, failed in samples),
+        hit_ratio=(hits.hit_ratio if hits is not None else None),
+    )
+
+
+def cache_delta(snapshots: Sequence[Sequence[CacheStats]], first: int, last: int) -> Optional[CacheStats]:
+    """Cache hits and misses between two window boundaries, summed over all processes."""
+    deltas = [
+        process_snapshots[min(last, len(process_snapshots) - 1)] - process_snapshots[first]
+        for process_snapshots in snapshots
+        if process_snapshots
+    ]
+    if not deltas:
+        return None
+    return CacheStats(sum(delta.hits for delta in deltas), sum(delta.misses for delta in deltas))
+
+
+def run_load_test(config: LoadConfig) -> LoadReport:
+    if config.mode not in MODES:
+        raise ValueError(f"unknown mode: {config.mode}")
+    if unknown_ops := set(config.mix) - set(OPS):
+        raise ValueError(f"unknown operations: {', '.join(unknown_ops)}")
+    run = {"threads": _run_threads, "asyncio": _run_asyncio, "processes": _run_processes}[config.mode]
+    start, samples, snapshots = run(config, read_corpus(config))
+    n_windows = max(1, math.ceil(config.duration / config.interval))
+    by_window: list[list[Sample]] = [[] for _ in range(n_windows)]
+    for sample in samples:
+        # Requests that were still running at the deadline are counted in the last window.
+        by_window[min(n_windows - 1, max(0, int((sample[0] - start) // config.interval)))].append(sample)
+    windows = [
+        summarize(
+            idx * config.interval,
+            min(config.interval, config.duration - idx * config.interval),
+            window_samples,
+            cache_delta(snapshots, idx, idx + 1),
+            config.slo,
+        )
+        for idx, window_samples in enumerate(by_window)
+    ]
+    total = summarize(0.0, config.duration, samples, cache_delta(snapshots, 0, n_windows), config.slo)
+    return LoadReport(windows, total)
+
+
+def format_window(stats: WindowStats, label: str) -> str:
+    hit_ratio = "-" if stats.hit_ratio is None else f"{stats.hit_ratio:.1%}"
+    return (
+        f"{label:>8} {stats.requests:>8} {stats.throughput:>9.1f} "
+        f"{stats.p50 * 1000:>8.1f} {stats.p95 * 1000:>8.1f} {stats.p99 * 1000:>8.1f} {stats.max * 1000:>8.1f} "
+        f"{stats.timeouts:>8} {stats.errors:>7} {hit_ratio:>7}"
+    )
+
+
+def print_report(report: LoadReport, as_json: bool = False) -> None:
+    if as_json:
+        for stats in report.windows:
+            print(json.dumps(dataclasses.asdict(stats)))
+        print(json.dumps({"total": dataclasses.asdict(report.total)}))
+        return
+    print(
+        f"{'time, s':>8} {'requests':>8} {'req/s':>9} {'p50, ms':>8} {'p95, ms':>8} {'p99, ms':>8} {'max, ms':>8} "
+        f"{'timeouts':>8} {'errors':>7} {'hits':>7}"
+    )
+    for stats in report.windows:
+        print(format_window(stats, f"{stats.start:g}"))
+    print(format_window(report.total, "total"))
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    """E.g. "reading=3,translate=1"."""
+    mix = {}
+    for item in spec.split(","):
+        op, _, weight = item.partition("=")
+        mix[op.strip()] = float(weight or 1)
+    return mix
+
+
+def parse_address(spec: str) -> Address:
+    """host:port or a path to a unix socket."""
+    host, sep, port = spec.rpartition(":")
+    if sep and port.isdigit():
+        return host, int(port)
+    return spec
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m mecab_controller load-test",
+        description="Send requests from many concurrent clients and report throughput and latency over time.",
+    )
+    parser.add_argument("corpus", nargs="?", help="text to cut inputs from (default: built-in sample sentences)")
+    parser.add_argument("--mode", choices=MODES, default="threads")
+    parser.add_argument("-c", "--clients", type=int, default=8)
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--interval", type=float, default=1.0, help="report every this many seconds")
+    parser.add_argument("--slo", type=float, default=0.5, help="requests slower than this many seconds are timeouts")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause between requests of a client")
+    parser.add_argument("--mix", type=parse_mix, default="reading=3,translate=1", help="e.g. reading=3,translate=1")
+    parser.add_argument("--mean-length", type=float, default=30.0, help="mean input length in characters")
+    parser.add_argument("--length-sigma", type=float, default=0.8, help="spread of the log-normal input lengths")
+    parser.add_argument("--repeat", type=float, default=0.3, help="share of inputs that repeat an earlier input")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--daemon", type=parse_address, help="host:port or unix socket of a running daemon")
+    parser.add_argument("--workers", type=int, help="mecab worker threads of the local controller")
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        help="start more workers (up to this many) when inputs queue up, stop them when they're idle",
+    )
+    parser.add_argument("--idle-timeout", type=float, default=30.0, help="seconds before an extra worker stops")
+    parser.add_argument("--backend", default="subprocess", help="subprocess, persistent, libmecab, fugashi or auto")
+    parser.add_argument("--coalesce-window", type=float, help="batch concurrent inputs, see MecabController")
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--compact-cache", action="store_true")
+    parser.add_argument("--digest-keys", action="store_true", help="cache analyses under digests of the inputs")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per window")
+    args = parser.parse_args(argv)
+
+    config = LoadConfig(
+        mode=args.mode,
+        clients=args.clients,
+        duration=args.duration,
+        interval=args.interval,
+        slo=args.slo,
+        think_time=args.think_time,
+        mix=args.mix,
+        mean_length=args.mean_length,
+        length_sigma=args.length_sigma,
+        repeat=args.repeat,
+        seed=args.seed,
+        corpus_path=args.corpus,
+        daemon=args.daemon,
+        controller_kwargs=dict(
+            workers=args.workers,
+            max_workers=args.max_workers,
+            worker_idle_timeout=args.idle_timeout,
+            coalesce_window=args.coalesce_window,
+            cache_max_size=args.cache_size,
+            compact_cache=args.compact_cache,
+            digest_keys=args.digest_keys,
+            backend=args.backend,
+        ),
+    )
+    print_report(run_load_test(config), as_json=args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,100 @@
 # Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
+import sys
+import threading
 from collections import OrderedDict
 from collections.abc import Hashable
-from typing import Generic, TypeVar
+from typing import Generic, NamedTuple, TypeVar
 
 K = TypeVar("K", bound=Hashable)
 V = TypeVar("V")
 
 
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / max(1, self.hits + self.misses)
+
+    def __sub__(self, other: "CacheStats") -> "CacheStats":
+        return CacheStats(self.hits - other.hits, self.misses - other.misses)
+
+
 class LRUCache(Generic[K, V]):
     """
     This class is used to cache results of calls to mecab.translate() instead of functools.lru_cache().
+    Every operation holds a lock, so one cache can be shared by many threads, including on free-threaded Python.
     """
 
     _cache: OrderedDict[K, V]
     _capacity: int
+    _hits: int
+    _misses: int
+    _lock: threading.Lock
 
     def __init__(self, capacity: int = 0) -> None:
         self._capacity = capacity
         self._cache = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def stats(self) -> CacheStats:
+        """Number of lookups that found and didn't find a value since the cache was created."""
+        with self._lock:
+            return CacheStats(self._hits, self._misses)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sys.getsizeof(self._cache)
+
+    def items(self) -> list[tuple[K, V]]:
+        """A snapshot of the entries, oldest first."""
+        with self._lock:
+            return list(self._cache.items())
 
     def __getitem__(self, key: K) -> V:
-        value = self._cache[key]
-        self._cache.move_to_end(key)
-        return value
+        with self._lock:
+            try:
+                value = self._cache[key]
+            except KeyError:
+                self._misses += 1
+                raise
+            self._hits += 1
+            self._cache.move_to_end(key)
+            return value
 
     def __setitem__(self, key: K, value: V) -> None:
-        self._cache[key] = value
-        self._cache.move_to_end(key)
-        self._clear_old_items()
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            self._clear_old_items()
+
+    def touch(self, key: K) -> None:
+        """Marks an entry as recently used, if it's present. Not counted as a lookup."""
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
 
     def set_capacity(self, capacity: int) -> None:
-        self._capacity = capacity
-        self._clear_old_items()
+        with self._lock:
+            self._capacity = capacity
+            self._clear_old_items()
 
     def _clear_old_items(self) -> None:
+        """Must be called with the lock held."""
         if self._capacity > 0:
             while len(self._cache) > self._capacity:
                 self._cache.popitem(last=False)
 
     def setdefault(self, key: K, value: V) -> V:
-        value = self._cache.setdefault(key, value)
-        self._cache.move_to_end(key)
-        return value
+        with self._lock:
+            value = self._cache.setdefault(key, value)
+            self._cache.move_to_end(key)
+            self._clear_old_items()
+            return value
@@ -1,51 +1,150 @@
 # Copyright: Ren Tatsumoto <tatsu at autistici.org> and contributors
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 import dataclasses
-import io
-import re
-from collections.abc import Iterable, Sequence
-from typing import Optional
+import functools
+import threading
+from collections.abc import Callable, Hashable, Iterable, Iterator, Sequence
+from typing import Optional, Union
 
 try:
-    from .basic_mecab_controller import BasicMecabController
+    from .background import BackgroundJob
+    from .backends import MecabBackend, close_backend, make_backend
+    from .basic_mecab_controller import BasicMecabController, MecabError, MecabStartError
     from .basic_types import (
         COMPONENTS,
+        FuriganaSegment,
         Inflection,
         MecabParsedToken,
         PartOfSpeech,
         Separators,
+        TextEdit,
+        TokenSpan,
     )
-    from .format import format_output
+    from .cache_keys import check_digest, digest_key
+    from .compact_cache import CompactCache
+    from .dispatcher import DispatcherStats, Priority, PriorityDispatcher
+    from .escape import (
+        Segment,
+        escape_text,
+        escape_text_with_offsets,
+        iter_markup_segments,
+        split_markup,
+    )
+    from .format import format_anki, split_furigana
     from .kana_conv import is_kana_str, to_hiragana, to_katakana
-    from .lru_cache import LRUCache
-    from .replace_mistakes import replace_mistakes
+    from .lru_cache import CacheStats, LRUCache
+    from .memory_usage import MemoryReport, measure_entries, traced_package_bytes
+    from .negative_cache import CircuitBreaker, FailureCache
+    from .replace_mistakes import iter_replace_mistakes, replace_mistakes
+    from .request_coalescer import RequestCoalescer, split_batch_output
+    from .slow_calls import SlowCallTracer
+    from .token_spans import align_tokens, reanalyze
 except ImportError:
-    from basic_mecab_controller import BasicMecabController
+    from background import BackgroundJob
+    from backends import MecabBackend, close_backend, make_backend
+    from basic_mecab_controller import BasicMecabController, MecabError, MecabStartError
     from basic_types import (
         COMPONENTS,
+        FuriganaSegment,
         Inflection,
         MecabParsedToken,
         PartOfSpeech,
         Separators,
+        TextEdit,
+        TokenSpan,
+    )
+    from cache_keys import check_digest, digest_key
+    from compact_cache import CompactCache
+    from dispatcher import DispatcherStats, Priority, PriorityDispatcher
+    from escape import (
+        Segment,
+        escape_text,
+        escape_text_with_offsets,
+        iter_markup_segments,
+        split_markup,
     )
-    from format import format_output
+    from format import format_anki, split_furigana
     from kana_conv import is_kana_str, to_hiragana, to_katakana
-    from lru_cache import LRUCache
-    from replace_mistakes import replace_mistakes
+    from lru_cache import CacheStats, LRUCache
+    from memory_usage import MemoryReport, measure_entries, traced_package_bytes
+    from negative_cache import CircuitBreaker, FailureCache
+    from replace_mistakes import iter_replace_mistakes, replace_mistakes
+    from request_coalescer import RequestCoalescer, split_batch_output
+    from slow_calls import SlowCallTracer
+    from token_spans import align_tokens, reanalyze
 
 
 # Mecab
 ##########################################################################
 
 
-def escape_text(text: str) -> str:
-    """Strip characters that trip up mecab."""
-    text = text.replace("\n", " ")
-    text = text.replace("\uff5e", "~")
-    text = re.sub(r"<[^<>]+>", "", text)
-    text = re.sub(r"\[sound:[^]]+]", "", text)
-    text = re.sub(r"\[\[type:[^]]+]]", "", text)
-    return text.strip()
+def parse_mecab_output(raw: str) -> Iterable[MecabParsedToken]:
+    """Parses mecab's output for one line of input. Returns a parsed token for each word."""
+    return parse_mecab_sections(raw.split(Separators.node))
+
+
+def parse_mecab_sections(sections: Iterable[str]) -> Iterator[MecabParsedToken]:
+    """Parses mecab's output split on the node separator. Tokens are yielded as soon as each section arrives."""
+    for section in sections:
+        if not section:
+            # ignore empty sections (can be at the end of a node)
+            continue
+        if section == Separators.footer:
+            break
+        components = section.split(Separators.component)
+        try:
+            word, headword, katakana_reading, part_of_speech, inflection = components
+        except ValueError:
+            # unknown to mecab, gave the same word back
+            word, headword, katakana_reading = components * 3
+            part_of_speech, inflection = None, None
+
+        if is_kana_str(word) or to_katakana(word) == to_katakana(katakana_reading):
+            katakana_reading = None
+
+        yield MecabParsedToken(
+            word=word,
+            headword=headword,
+            katakana_reading=(katakana_reading or None),
+            part_of_speech=PartOfSpeech(part_of_speech or None),
+            inflection_type=Inflection(inflection or None),
+        )
+
+
+def furigana_segments(tokens: Iterable[MecabParsedToken]) -> list[FuriganaSegment]:
+    """Splits tokens into (base, ruby) segments. Ruby is None for text that doesn't need a reading."""
+    segments = []
+    for out in tokens:
+        if out.katakana_reading and to_katakana(out.katakana_reading) != to_katakana(out.word):
+            segments.extend(split_furigana(out.word, to_hiragana(out.katakana_reading)))
+        else:
+            segments.append(FuriganaSegment(out.word, None))
+    return segments
+
+
+def format_reading(tokens: Iterable[MecabParsedToken]) -> str:
+    """Formats furigana using Anki syntax, e.g. 野獣[やじゅう]の 様[よう]な 男[おとこ]."""
+    return format_anki(furigana_segments(tokens))
+
+
+WARM_UP_TEXT = "昨日すき焼きを食べました"
+
+
+def traced(method):
+    """Records slow calls of the method with the controller's tracer, if it has one."""
+
+    @functools.wraps(method)
+    def wrapper(self: "MecabController", expr: str, *args, **kwargs):
+        if self._tracer is None or (call := self._tracer.start()) is None:
+            # Not tracing, or called by another traced method.
+            return method(self, expr, *args, **kwargs)
+        queue_depth = self._dispatcher.queue_depth() if self._dispatcher else None
+        try:
+            return method(self, expr, *args, **kwargs)
+        finally:
+            self._tracer.finish(call, method.__name__, expr, queue_depth)
+
+    return wrapper
 
 
 class MecabController:
@@ -54,9 +153,34 @@ class MecabController:
         "--unk-format=" + COMPONENTS.word + Separators.node,
         "--eos-format=" + Separators.footer,
     ]
-    _mecab: BasicMecabController
+    _mecab: MecabBackend
     _verbose: bool
-    _cache: LRUCache[str, Sequence[MecabParsedToken]] = LRUCache()
+    _cache: Union[LRUCache[Hashable, Sequence[MecabParsedToken]], CompactCache]
+    _failures: FailureCache
+    _breaker: CircuitBreaker
+    _dispatcher: Optional[PriorityDispatcher]
+    _coalescers: dict[Priority, RequestCoalescer]
+    _fallback_reader: Optional[Callable[[str], Sequence[MecabParsedToken]]]
+    _last_error: Optional[MecabStartError]
+    _digest_key: Optional[Callable[[str], Hashable]]
+    _digest_checks: Optional[LRUCache[Hashable, bytes]]
+    _digest_collisions: int
+    _tracer: Optional[SlowCallTracer]
+    _owns_backend: bool
+
+    @classmethod
+    def make_backend(
+        cls,
+        mecab_cmd: Optional[list[str]] = None,
+        mecab_args: Optional[list[str]] = None,
+        verbose: bool = False,
+        name: str = "subprocess",
+    ) -> MecabBackend:
+        """
+        A backend (by default, a mecab process for each call) that prints its output
+        in the format parse_mecab_output() expects. See backends.BACKENDS for the names, or pass "auto".
+        """
+        return make_backend(name, mecab_cmd, (mecab_args or cls._mecab_args), verbose)
 
     def __init__(
         self,
@@ -64,64 +188,474 @@ class MecabController:
         mecab_args: Optional[list[str]] = None,
         verbose: bool = False,
         cache_max_size: int = 1024,
+        failure_cache_max_size: int = 256,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        coalesce_window: Optional[float] = None,
+        coalesce_max_items: int = 64,
+        workers: Optional[int] = None,
+        bulk_share: float = 0.25,
+        max_workers: Optional[int] = None,
+        worker_idle_timeout: float = 30.0,
+        fallback_reader: Optional[Callable[[str], Sequence[MecabParsedToken]]] = None,
+        backend: Union[None, str, MecabBackend] = None,
+        compact_cache: bool = False,
+        hot_cache_size: int = 64,
+        cache_compression: Optional[str] = None,
+        digest_keys: bool = False,
+        verify_digests: bool = False,
+        tracer: Optional[SlowCallTracer] = None,
     ) -> None:
-        self._mecab = BasicMecabController(
-            mecab_cmd=mecab_cmd,
-            mecab_args=(mecab_args or self._mecab_args),
-            verbose=verbose,
+        """
+        If coalesce_window is set, inputs from concurrent callers that arrive within
+        this many seconds (or until coalesce_max_items are collected) are sent to mecab as one batch.
+        If workers is set, inputs are run on this many mecab worker threads,
+        and interactive inputs are served before queued bulk inputs (see PriorityDispatcher).
+        If max_workers is set, up to this many workers are started when inputs queue up,
+        and workers above `workers` exit after worker_idle_timeout seconds without work.
+        fallback_reader is used instead of mecab when mecab fails or the circuit breaker is open,
+        e.g. KakasiReader().translate. Without it, the text is left unanalyzed,
+        except when mecab can't be started at all: then MecabStartError is raised (see last_error).
+        backend is the name of a backend (see backends.BACKENDS, or "auto" to pick the fastest one that works),
+        or an object that replaces the mecab process, e.g. a ReplayMecabController.
+        It must produce output in the format requested by make_backend().
+        If compact_cache is set, the cache stores entries encoded
+        (optionally compressed with cache_compression, "zlib" or "zstd") and decodes them when they are read,
+        which fits several times more entries into the same memory. See CompactCache.
+        If digest_keys is set, entries are cached under a 128-bit digest of the escaped input instead of the input,
+        so that long inputs aren't kept alive by the cache. verify_digests implies digest_keys,
+        and also stores a second, independent digest of each input (see check_digest()) that is compared on every hit.
+        A hit whose check doesn't match is a digest collision: it's counted (see digest_collisions()),
+        treated as a miss, and the entry is replaced once the input has been analyzed.
+        The same key is used for the failure cache, see cache_key().
+        If tracer is set, calls to translate(), reading() and furigana() that take longer than its threshold
+        are recorded with the time spent in each stage. See SlowCallTracer.
+        """
+        self._owns_backend = backend is None or isinstance(backend, str)
+        if self._owns_backend:
+            self._mecab = self.make_backend(mecab_cmd, mecab_args, verbose, name=(backend or "subprocess"))
+        else:
+            self._mecab = backend
+        # Each controller has its own cache, so that a controller with a small cache_max_size doesn't evict
+        # the entries of another one.
+        if compact_cache:
+            self._cache = CompactCache(cache_max_size, hot_cache_size, cache_compression)
+        else:
+            self._cache = LRUCache(cache_max_size)
+        self._failures = FailureCache(failure_cache_max_size)
+        self._breaker = circuit_breaker or CircuitBreaker()
+        self._dispatcher = (
+            PriorityDispatcher(
+                self._mecab.run,
+                workers=(workers or 0),
+                bulk_share=bulk_share,
+                max_workers=max_workers,
+                idle_timeout=worker_idle_timeout,
+            )
+            if workers or max_workers
+            else None
+        )
+        self._coalescers = (
+            {
+                priority: RequestCoalescer(
+                    functools.partial(self._dispatch, priority=priority),
+                    window=coalesce_window,
+                    max_items=coalesce_max_items,
+                    max_inflight=(max_workers or workers or 1),
+                )
+                for priority in Priority
+            }
+            if coalesce_window is not None
+            else {}
         )
-        self._cache.set_capacity(cache_max_size)
+        self._fallback_reader = fallback_reader
+        self._last_error = None
+        self._digest_key = digest_key if (digest_keys or verify_digests) else None
+        # Kept in the same order as the cache: both have the same capacity and every access is mirrored.
+        self._digest_checks = LRUCache(cache_max_size) if verify_digests else None
+        self._digest_collisions = 0
+        self._tracer = tracer
         self._verbose = verbose
 
-    def translate(self, expr: str) -> Sequence[MecabParsedToken]:
+    def close(self) -> None:
+        """
+        Stops the coalescers, then the worker threads, then the backend's mecab processes
+        (unless the backend was passed in, then it's left to the caller).
+        """
+        for coalescer in self._coalescers.values():
+            coalescer.close()
+        if self._dispatcher:
+            self._dispatcher.close()
+        if self._owns_backend:
+            close_backend(self._mecab)
+
+    def __enter__(self) -> "MecabController":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def cache_key(self, expr: str) -> Hashable:
+        """The key the analysis of expr is cached under. Other cache tiers (e.g. on disk) can reuse it."""
+        return self._lookup_key(expr)[0]
+
+    def _lookup_key(self, expr: str) -> tuple[Hashable, Optional[str]]:
+        """Returns the cache key, and the escaped text if it was needed to compute the key."""
+        if self._digest_key:
+            escaped = escape_text(expr)
+            return self._digest_key(escaped), escaped
+        return expr, None
+
+    def _lookup(self, expr: str) -> tuple[Hashable, Optional[str], Optional[Sequence[MecabParsedToken]]]:
+        """Returns the cache key, the escaped text if it was needed to compute the key, and the cached tokens."""
+        key, escaped = self._lookup_key(expr)
         try:
-            return self._cache[expr]
+            tokens = self._cache[key]
         except KeyError:
-            return self._cache.setdefault(expr, tuple(self._translate(expr)))
+            return key, escaped, None
+        if self._digest_checks is not None and not self._check_digest(key, escaped):
+            return key, escaped, None
+        return key, escaped, tokens
 
-    def _translate(self, expr: str) -> Iterable[MecabParsedToken]:
-        """Analyzes expr with mecab. Fixes mecab's mistakes. Returns a parsed token for each word in expr."""
-        for token in replace_mistakes(self._analyze(expr)):
+    def _check_digest(self, key: Hashable, escaped: str) -> bool:
+        """Whether a cached entry was stored for this input. Only called with verify_digests."""
+        try:
+            stored = self._digest_checks[key]
+        except KeyError:
+            # Can't be verified, the entry is analyzed again.
+            return False
+        if stored == check_digest(escaped):
+            return True
+        self._digest_collisions += 1
+        if self._verbose:
+            print(f"digest collision on {key!r}: {escaped[:60]!r}")
+        return False
+
+    def _store(self, key: Hashable, escaped: str, tokens: Sequence[MecabParsedToken]) -> Sequence[MecabParsedToken]:
+        """Caches tokens unless another thread has cached the same input first. Returns the cached tokens."""
+        if self._digest_checks is None:
+            return self._cache.setdefault(key, tokens)
+        check = check_digest(escaped)
+        if self._digest_checks.setdefault(key, check) == check:
+            return self._cache.setdefault(key, tokens)
+        # The entry belongs to another input with the same digest. Replace it.
+        self._digest_checks[key] = check
+        self._cache[key] = tokens
+        return tokens
+
+    def digest_collisions(self) -> int:
+        """Cache hits rejected because the input's check digest didn't match the entry's, see verify_digests."""
+        return self._digest_collisions
+
+    def _failure_key(self, key: Hashable, escaped: str) -> Hashable:
+        """Failures are remembered per escaped text. Digest keys are computed from the escaped text already."""
+        return key if self._digest_key else escaped
+
+    @traced
+    def translate(self, expr: str, priority: Priority = Priority.interactive) -> Sequence[MecabParsedToken]:
+        key, escaped, tokens = self._lookup(expr)
+        self._mark("cache")
+        if tokens is not None:
+            self._set_cache_status("hit")
+            return tokens
+        escaped = escape_text(expr) if escaped is None else escaped
+        failure_key = self._failure_key(key, escaped)
+        if failure_key in self._failures or not self._breaker.allow():
+            self._set_cache_status("fallback")
+            return self._fallback(escaped)
+        try:
+            tokens = tuple(self._translate(escaped, priority))
+        except MecabStartError as ex:
+            self._set_cache_status("error")
+            self._start_failed(ex)
+            return self._fallback(escaped)
+        except MecabError as ex:
+            if self._verbose:
+                print("mecab failed:", ex)
+            self._set_cache_status("error")
+            self._failures.add(failure_key)
+            self._breaker.record_failure()
+            return self._fallback(escaped)
+        self._mark("parse")
+        self._record_success()
+        return self._store(key, escaped, tokens)
+
+    @property
+    def last_error(self) -> Optional[MecabStartError]:
+        """Why mecab couldn't be started the last time it was tried, or None if it started since."""
+        return self._last_error
+
+    def _start_failed(self, ex: MecabStartError) -> None:
+        """
+        Mecab can't run on this system, whatever the input. Not remembered in the failure cache.
+        Raised again unless there's a fallback reader, so that the user can be told what's wrong.
+        """
+        self._last_error = ex
+        if self._verbose:
+            print("mecab couldn't start:", ex)
+        if not self._fallback_reader:
+            self._breaker.release()
+            raise ex
+        self._breaker.record_failure()
+
+    def _record_success(self) -> None:
+        self._last_error = None
+        self._breaker.record_success()
+
+    def _mark(self, stage: str) -> None:
+        if self._tracer:
+            self._tracer.mark(stage)
+
+    def _set_cache_status(self, status: str) -> None:
+        if self._tracer:
+            self._tracer.set_cache_status(status)
+
+    def _fallback(self, escaped: str) -> Sequence[MecabParsedToken]:
+        """Returned instead of mecab's analysis when mecab can't be used."""
+        if self._fallback_reader:
+            return self._fallback_reader(escaped)
+        if not escaped:
+            return ()
+        return (
+            MecabParsedToken(
+                word=escaped,
+                headword=escaped,
+                katakana_reading=None,
+                part_of_speech=PartOfSpeech.unknown,
+                inflection_type=Inflection.unknown,
+            ),
+        )
+
+    def iter_translate(self, expr: str) -> Iterator[MecabParsedToken]:
+        """
+        Like translate(), but tokens are yielded while mecab is still analyzing the rest of the input,
+        which lowers the time to the first token for long inputs.
+        Bypasses the worker threads and the coalescer. The result is cached once all tokens have been consumed.
+        """
+        key, escaped, cached = self._lookup(expr)
+        if cached is not None:
+            yield from cached
+            return
+        escaped = escape_text(expr) if escaped is None else escaped
+        failure_key = self._failure_key(key, escaped)
+        if failure_key in self._failures or not self._breaker.allow():
+            yield from self._fallback(escaped)
+            return
+        tokens = []
+        try:
+            sections = self._mecab.iter_run(escaped, Separators.node)
+            for token in iter_replace_mistakes(parse_mecab_sections(sections)):
+                tokens.append(token)
+                yield token
+        except GeneratorExit:
+            # The caller stopped iterating early, there's no outcome to record.
+            self._breaker.release()
+            raise
+        except MecabStartError as ex:
+            self._start_failed(ex)
+            yield from self._fallback(escaped)
+            return
+        except MecabError as ex:
+            if self._verbose:
+                print("mecab failed:", ex)
+            self._failures.add(failure_key)
+            self._breaker.record_failure()
+            # Tokens that were already yielded can't be taken back, add the rest unanalyzed.
+            spans = align_tokens(escaped, range(len(escaped)), tokens)
+            yield from self._fallback(escaped[spans[-1].end :].strip() if spans else escaped)
+            return
+        self._record_success()
+        self._store(key, escaped, tuple(tokens))
+
+    def translate_many(
+        self, exprs: Iterable[str], priority: Priority = Priority.bulk
+    ) -> list[Sequence[MecabParsedToken]]:
+        """Like translate(), but inputs that aren't cached yet are sent to mecab as one batch."""
+        exprs = list(exprs)
+        keys: list[Hashable] = []
+        results: list[Optional[Sequence[MecabParsedToken]]] = []
+        missing: dict[str, list[int]] = {}
+        for idx, expr in enumerate(exprs):
+            key, escaped, tokens = self._lookup(expr)
+            keys.append(key)
+            results.append(tokens)
+            if tokens is None:
+                missing.setdefault(escape_text(expr) if escaped is None else escaped, []).append(idx)
+        batch = [
+            escaped
+            for escaped, indices in missing.items()
+            if self._failure_key(keys[indices[0]], escaped) not in self._failures
+        ]
+        if batch and self._breaker.allow():
+            try:
+                outputs = split_batch_output(self._dispatch("\n".join(batch), priority), len(batch))
+            except MecabError:
+                # translate() runs the inputs one by one below and remembers the ones that fail.
+                self._breaker.release()
+                outputs = []
+            else:
+                self._record_success()
+            for escaped, raw in zip(batch, outputs):
+                tokens = tuple(self._fix_mistakes(parse_mecab_output(raw)))
+                for idx in missing[escaped]:
+                    results[idx] = self._store(keys[idx], escaped, tokens)
+        return [self.translate(expr, priority) if tokens is None else tokens for expr, tokens in zip(exprs, results)]
+
+    def warm_up(self) -> BackgroundJob:
+        """
+        Runs mecab once in the background. Returns immediately.
+        Backends that keep mecab loaded (persistent, libmecab, fugashi) start it and load the dictionary here,
+        so the first translate() doesn't wait for them. The default subprocess backend starts mecab
+        for every call, so warming up only gets the dictionary into the OS file cache.
+        This makes the first call faster after a cold boot, but later calls are no faster.
+        If mecab can't be started, the returned job's wait() raises MecabStartError (see last_error).
+        """
+        return BackgroundJob(self._warm_up, name="mecab_warm_up")
+
+    def _warm_up(self, cancelled: threading.Event) -> None:
+        try:
+            self._dispatch(escape_text(WARM_UP_TEXT), Priority.idle)
+        except MecabStartError as ex:
+            self._start_failed(ex)
+        except MecabError as ex:
+            if self._verbose:
+                print("mecab failed to warm up:", ex)
+            self._breaker.record_failure()
+        else:
+            self._record_success()
+
+    def prefetch(self, exprs: Iterable[str]) -> BackgroundJob:
+        """
+        Analyzes inputs in the background and caches them, e.g. the fields of the cards the user is about to view.
+        Returns immediately. Call cancel() on the returned job to stop early.
+        With worker threads, prefetched inputs only run when no interactive or bulk input is waiting.
+        Without them, one input is analyzed at a time by a separate mecab process, so foreground calls don't wait.
+        """
+        return BackgroundJob(functools.partial(self._prefetch, exprs), name="mecab_prefetch")
+
+    def _prefetch(self, exprs: Iterable[str], cancelled: threading.Event) -> None:
+        for expr in exprs:
+            if cancelled.is_set():
+                return
+            self.translate(expr, Priority.idle)
+
+    def _translate(self, escaped: str, priority: Priority) -> Iterable[MecabParsedToken]:
+        """Analyzes escaped text with mecab. Fixes mecab's mistakes. Returns a parsed token for each word."""
+        return self._fix_mistakes(self._analyze(escaped, priority))
+
+    def _fix_mistakes(self, tokens: Iterable[MecabParsedToken]) -> Iterable[MecabParsedToken]:
+        for token in replace_mistakes(tokens):
             if self._verbose:
                 print(*dataclasses.astuple(token), sep="\t")
             yield token
 
-    def _analyze(self, expr: str) -> Iterable[MecabParsedToken]:
-        """Analyzes expr with mecab. Returns a parsed token for each word in expr."""
-        for section in self._mecab.run(escape_text(expr)).split(Separators.node):
-            if not section:
-                # ignore empty sections (can be at the end of a node)
-                continue
-            if section == Separators.footer:
-                break
-            components = section.split(Separators.component)
-            try:
-                word, headword, katakana_reading, part_of_speech, inflection = components
-            except ValueError:
-                # unknown to mecab, gave the same word back
-                word, headword, katakana_reading = components * 3
-                part_of_speech, inflection = None, None
-
-            if is_kana_str(word) or to_katakana(word) == to_katakana(katakana_reading):
-                katakana_reading = None
-
-            yield MecabParsedToken(
-                word=word,
-                headword=headword,
-                katakana_reading=(katakana_reading or None),
-                part_of_speech=PartOfSpeech(part_of_speech or None),
-                inflection_type=Inflection(inflection or None),
-            )
+    def _run(self, escaped: str, priority: Priority) -> str:
+        if self._coalescers:
+            return self._coalescers[priority].submit(escaped)
+        return self._dispatch(escaped, priority)
+
+    def _dispatch(self, escaped: str, priority: Priority) -> str:
+        if self._dispatcher:
+            return self._dispatcher.submit(escaped, priority)
+        return self._mecab.run(escaped)
+
+    def _analyze(self, escaped: str, priority: Priority = Priority.interactive) -> Iterable[MecabParsedToken]:
+        """Analyzes escaped text with mecab. Returns a parsed token for each word."""
+        raw = self._run(escaped, priority)
+        # Includes waiting for a worker or for other inputs to be batched with this one.
+        self._mark("mecab")
+        return parse_mecab_output(raw)
+
+    def worker_stats(self) -> Optional[DispatcherStats]:
+        """Number of workers and recent scaling events, or None without worker threads."""
+        return self._dispatcher.stats() if self._dispatcher else None
+
+    def cache_stats(self) -> CacheStats:
+        """Cache hits and misses since the controller was created."""
+        return self._cache.stats()
+
+    def memory_usage(self, use_tracemalloc: bool = False) -> MemoryReport:
+        """
+        Approximate memory held by the analysis cache of this controller,
+        the token objects and strings in it, and the buffers used to read mecab's output.
+        With use_tracemalloc, also report what tracemalloc attributes to this package (if it's tracing).
+        """
+        report = measure_entries(list(self._cache.items()), container=self._cache)
+        if isinstance(self._cache, CompactCache):
+            # Only the hot tier is decoded, the rest is counted as encoded bytes.
+            report.cache_entries = len(self._cache)
+            report.compact_bytes = self._cache.compact_bytes()
+        report.buffer_bytes = self._mecab.buffer_bytes()
+        if use_tracemalloc:
+            report.traced_bytes = traced_package_bytes()
+        return report
+
+    def translate_spans(self, expr: str, priority: Priority = Priority.interactive) -> Sequence[TokenSpan]:
+        """Like translate(), but also returns the position of each token in expr."""
+        escaped, offsets = escape_text_with_offsets(expr)
+        return align_tokens(escaped, offsets, self.translate(expr, priority))
 
-    def reading(self, expr: str) -> str:
+    def reanalyze(
+        self,
+        old_text: str,
+        old_spans: Sequence[TokenSpan],
+        edit: TextEdit,
+        priority: Priority = Priority.interactive,
+    ) -> Sequence[TokenSpan]:
+        """
+        Returns spans for edit.apply(old_text), given the spans of old_text.
+        Only the sentences touched by the edit are analyzed again.
+        """
+        return reanalyze(functools.partial(self.translate_spans, priority=priority), old_text, old_spans, edit)
+
+    @traced
+    def reading(self, expr: str, priority: Priority = Priority.interactive) -> str:
         """Formats furigana using Anki syntax, e.g. 野獣[やじゅう]の 様[よう]な 男[おとこ]."""
-        buf = io.StringIO()
-        for out in self.translate(expr):
-            if out.katakana_reading and to_katakana(out.katakana_reading) != to_katakana(out.word):
-                buf.write(format_output(out.word, to_hiragana(out.katakana_reading)))
-            else:
-                buf.write(out.word)
-        return buf.getvalue()
+        formatted = format_reading(self.translate(expr, priority))
+        self._mark("format")
+        return formatted
+
+    @traced
+    def furigana(self, expr: str, priority: Priority = Priority.interactive) -> Sequence[FuriganaSegment]:
+        """
+        Like reading(), but returns (base, ruby) segments instead of a string,
+        e.g. to render with format_anki() or format_html().
+        """
+        segments = furigana_segments(self.translate(expr, priority))
+        self._mark("format")
+        return segments
+
+    def reading_preserving_markup(self, expr: str, priority: Priority = Priority.interactive) -> str:
+        """
+        Like reading(), but HTML tags, [sound:...] tags and line breaks are kept in place.
+        Only the text between them is sent to mecab.
+        """
+        return "".join(self._splice_readings(split_markup(expr), priority))
+
+    def iter_reading_preserving_markup(
+        self, chunks: Iterable[str], priority: Priority = Priority.interactive
+    ) -> Iterator[str]:
+        """Like reading_preserving_markup(), but for large inputs that arrive in chunks."""
+        return self._splice_readings(iter_markup_segments(chunks), priority)
+
+    def _splice_readings(self, segments: Iterable[Segment], priority: Priority) -> Iterator[str]:
+        for segment in segments:
+            if segment.is_markup:
+                yield segment.text
+                continue
+            for idx, line in enumerate(segment.text.split("\n")):
+                if idx > 0:
+                    yield "\n"
+                if stripped := line.strip():
+                    # escape_text() strips whitespace, keep it around the reading.
+                    yield line[: len(line) - len(line.lstrip())]
+                    yield self.reading(stripped, priority)
+                    yield line[len(line.rstrip()) :]
+                else:
+                    yield line
+
+    def reading_many(self, exprs: Iterable[str], priority: Priority = Priority.bulk) -> list[str]:
+        """Like reading(), but inputs that aren't cached yet are sent to mecab as one batch."""
+        return [format_reading(tokens) for tokens in self.translate_many(exprs, priority)]
 
 
 def main():
@@ -1,17 +1,21 @@
 # Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
-import functools
 import os
 import shutil
 import sys
 
+try:
+    from .memoize import memoize
+except ImportError:
+    from memoize import memoize
+
 IS_MAC = sys.platform.startswith("darwin")
 IS_WIN = sys.platform.startswith("win32")
 SUPPORT_DIR = os.path.join(os.path.dirname(__file__), "support")
 
 
-@functools.cache
+@memoize
 def support_exe_suffix() -> str:
     """
     The mecab executable file in the "support" dir has a different suffix depending on the platform.
@@ -36,7 +40,7 @@ def get_bundled_executable(name: str) -> str:
     return path_to_exe
 
 
-@functools.cache
+@memoize
 def find_executable(name: str) -> str:
     """
     If possible, use the executable installed in the system.
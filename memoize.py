@@ -0,0 +1,31 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import functools
+import threading
+from collections.abc import Callable
+from typing import TypeVar
+
+R = TypeVar("R")
+
+
+def memoize(fn: Callable[..., R]) -> Callable[..., R]:
+    """
+    Like functools.cache, but fn runs at most once for the same arguments,
+    even if several threads call it at the same time (e.g. on free-threaded Python).
+    """
+    results: dict[tuple, R] = {}
+    lock = threading.Lock()
+
+    @functools.wraps(fn)
+    def wrapper(*args):
+        try:
+            return results[args]
+        except KeyError:
+            pass
+        with lock:
+            if args not in results:
+                results[args] = fn(*args)
+            return results[args]
+
+    return wrapper
@@ -0,0 +1,148 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Approximate accounting of the memory held by cached analyses.
+"""
+
+import dataclasses
+import enum
+import os
+import sys
+import tracemalloc
+from collections.abc import Iterable
+from typing import Any, Optional
+
+try:
+    from .basic_types import MecabParsedToken
+except ImportError:
+    from basic_types import MecabParsedToken
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@dataclasses.dataclass
+class MemoryReport:
+    cache_entries: int = 0
+    token_count: int = 0  # distinct token objects
+    string_count: int = 0  # distinct string objects (keys, words, readings)
+    container_bytes: int = 0  # the cache itself and the tuples of tokens
+    token_bytes: int = 0  # token objects without the strings they reference
+    string_bytes: int = 0
+    compact_bytes: int = 0  # encoded entries of a CompactCache
+    buffer_bytes: int = 0  # buffers for reading mecab's output
+    traced_bytes: Optional[int] = None  # memory allocated by this package according to tracemalloc
+
+    @property
+    def total_bytes(self) -> int:
+        return (
+            self.container_bytes + self.token_bytes + self.string_bytes + self.compact_bytes + self.buffer_bytes
+        )
+
+    @property
+    def bytes_per_token(self) -> float:
+        return (self.token_bytes + self.string_bytes) / max(1, self.token_count)
+
+
+class _Accountant:
+    """Counts each object once, even if it's shared between cache entries."""
+
+    def __init__(self, report: MemoryReport) -> None:
+        self._report = report
+        self._seen: set[int] = set()
+
+    def _first_time(self, obj: Any) -> bool:
+        if id(obj) in self._seen:
+            return False
+        self._seen.add(id(obj))
+        return True
+
+    def add_string(self, string: Optional[str]) -> None:
+        if string is not None and self._first_time(string):
+            self._report.string_count += 1
+            self._report.string_bytes += sys.getsizeof(string)
+
+    def add_token(self, token: MecabParsedToken) -> None:
+        if not self._first_time(token):
+            return
+        self._report.token_count += 1
+        self._report.token_bytes += sys.getsizeof(token)
+        if hasattr(token, "__dict__"):
+            self._report.token_bytes += sys.getsizeof(token.__dict__)
+        for field in dataclasses.fields(token):
+            value = getattr(token, field.name)
+            # Enum members are shared singletons and aren't counted.
+            if not isinstance(value, enum.Enum):
+                self.add_string(value)
+
+    def add_entry(self, key: Any, tokens: Iterable[MecabParsedToken]) -> None:
+        self._report.cache_entries += 1
+        if isinstance(key, str):
+            self.add_string(key)
+        elif self._first_time(key):
+            self._report.container_bytes += sys.getsizeof(key)
+        if self._first_time(tokens):
+            self._report.container_bytes += sys.getsizeof(tokens)
+        for token in tokens:
+            self.add_token(token)
+
+
+def measure_entries(entries: Iterable[tuple[Any, Iterable[MecabParsedToken]]], container: Any = None) -> MemoryReport:
+    """Approximate memory held by (key, tokens) pairs, e.g. the items of a cache."""
+    report = MemoryReport()
+    accountant = _Accountant(report)
+    if container is not None:
+        report.container_bytes += sys.getsizeof(container)
+    for key, tokens in entries:
+        accountant.add_entry(key, tokens)
+    return report
+
+
+def traced_package_bytes() -> Optional[int]:
+    """
+    Memory currently allocated by code in this package, according to a tracemalloc snapshot.
+    Returns None unless tracemalloc is tracing (see tracemalloc.start()).
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(True, os.path.join(PACKAGE_DIR, "*")),))
+    return sum(stat.size for stat in snapshot.statistics("filename"))
+
+
+# Regression thresholds checked by main(). The strings depend on the input, the token objects don't.
+MAX_TOKEN_OBJECT_BYTES = 200
+MAX_BYTES_PER_TOKEN = 512
+
+
+def main():
+    try:
+        from .basic_types import Separators
+        from .mecab_controller import parse_mecab_output
+    except ImportError:
+        from basic_types import Separators
+        from mecab_controller import parse_mecab_output
+
+    def fake_output(idx: int) -> str:
+        nodes = (
+            ("昨日", "昨日", "キノウ", "名詞", "*"),
+            ("すき焼き", "すき焼き", "スキヤキ", "名詞", "*"),
+            ("を", "を", "ヲ", "助詞", "*"),
+            (f"食べ{idx}", "食べる", "タベ", "動詞", "連用形"),
+        )
+        return "".join(Separators.component.join(node) + Separators.node for node in nodes) + Separators.footer
+
+    tracemalloc.start()
+    entries = [(f"昨日すき焼きを食べ{idx}", tuple(parse_mecab_output(fake_output(idx)))) for idx in range(1000)]
+    report = measure_entries(entries, container=entries)
+    report.traced_bytes = traced_package_bytes()
+    tracemalloc.stop()
+    print(report)
+    print(f"{report.bytes_per_token:.1f} bytes per token")
+    assert report.token_count == 4000
+    assert report.token_bytes / report.token_count <= MAX_TOKEN_OBJECT_BYTES, "token objects got bigger"
+    assert report.bytes_per_token <= MAX_BYTES_PER_TOKEN, "tokens got bigger"
+    print("Ok.")
+
+
+if __name__ == "__main__":
+    main()
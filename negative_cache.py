@@ -0,0 +1,162 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import collections
+import enum
+import threading
+import time
+from typing import Optional
+
+try:
+    from .lru_cache import LRUCache
+except ImportError:
+    from lru_cache import LRUCache
+
+
+class FailureCache:
+    """
+    Remembers inputs that made mecab hang or crash,
+    so that analyzing them again doesn't pay the full timeout every time.
+    Entries expire after `ttl` seconds in case the failure was transient.
+    """
+
+    _failures: LRUCache[str, float]
+    _ttl: float
+
+    def __init__(self, capacity: int = 256, ttl: float = 600.0) -> None:
+        self._failures = LRUCache(capacity)
+        self._ttl = ttl
+
+    def __contains__(self, key: str) -> bool:
+        try:
+            failed_at = self._failures[key]
+        except KeyError:
+            return False
+        return time.monotonic() - failed_at < self._ttl
+
+    def add(self, key: str) -> None:
+        self._failures[key] = time.monotonic()
+
+
+class BreakerState(enum.Enum):
+    closed = "closed"  # mecab is healthy, all calls go through.
+    open = "open"  # too many recent failures, calls are rejected until the cooldown passes.
+    half_open = "half_open"  # the cooldown has passed, one trial call decides what happens next.
+
+
+class CircuitBreaker:
+    """
+    Stops sending inputs to mecab when the failure rate of recent calls spikes.
+    While the breaker is open, callers should return a fallback result right away.
+    """
+
+    _outcomes: collections.deque[bool]
+    _failure_ratio: float
+    _min_calls: int
+    _cooldown: float
+    _state: BreakerState
+    _opened_at: float
+    _trial_timeout: float
+    _trial_started_at: Optional[float]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        window: int = 20,
+        failure_ratio: float = 0.5,
+        min_calls: int = 5,
+        cooldown: float = 30.0,
+        trial_timeout: float = 30.0,
+    ) -> None:
+        """A trial call that hasn't reported its outcome after trial_timeout seconds is given up on."""
+        self._outcomes = collections.deque(maxlen=window)
+        self._failure_ratio = failure_ratio
+        self._min_calls = min_calls
+        self._cooldown = cooldown
+        self._state = BreakerState.closed
+        self._opened_at = 0.0
+        self._trial_timeout = trial_timeout
+        self._trial_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> BreakerState:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> BreakerState:
+        """Must be called with the lock held."""
+        if self._state == BreakerState.open and time.monotonic() - self._opened_at >= self._cooldown:
+            self._state = BreakerState.half_open
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Whether the next call should be sent to mecab.
+        When half-open, only one trial call is let through until its outcome is recorded.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state != BreakerState.half_open:
+                return state == BreakerState.closed
+            now = time.monotonic()
+            if self._trial_started_at is not None and now - self._trial_started_at < self._trial_timeout:
+                return False
+            self._trial_started_at = now
+            return True
+
+    def release(self) -> None:
+        """The allowed call ended without an outcome, e.g. it's going to be retried in parts."""
+        with self._lock:
+            self._trial_started_at = None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._trial_started_at = None
+            if self._state == BreakerState.half_open:
+                self._outcomes.clear()
+                self._state = BreakerState.closed
+            self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._trial_started_at = None
+            self._outcomes.append(False)
+            if self._state == BreakerState.half_open or self._failure_rate_exceeded():
+                self._state = BreakerState.open
+                self._opened_at = time.monotonic()
+
+    def _failure_rate_exceeded(self) -> bool:
+        """Must be called with the lock held."""
+        if len(self._outcomes) < self._min_calls:
+            return False
+        return self._outcomes.count(False) / len(self._outcomes) >= self._failure_ratio
+
+
+def main():
+    failures = FailureCache(capacity=2, ttl=60)
+    failures.add("a")
+    assert "a" in failures
+    assert "b" not in failures
+
+    breaker = CircuitBreaker(window=4, failure_ratio=0.5, min_calls=4, cooldown=0)
+    for _ in range(2):
+        breaker.record_success()
+        breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == BreakerState.half_open
+    assert not breaker.allow(), "only one trial call at a time"
+    breaker.record_success()
+    assert breaker.state == BreakerState.closed
+    assert breaker.allow() and breaker.allow()
+
+    breaker = CircuitBreaker(window=4, failure_ratio=0.5, min_calls=4, cooldown=60)
+    for _ in range(4):
+        breaker.record_failure()
+    assert breaker.state == BreakerState.open
+    assert not breaker.allow()
+    print("Ok.")
+
+
+if __name__ == "__main__":
+    main()
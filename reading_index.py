@@ -0,0 +1,169 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import gzip
+import json
+from collections.abc import Iterable, Sequence
+from typing import NamedTuple, Optional
+
+try:
+    from .unify_readings import literal_pronunciation
+except ImportError:
+    from unify_readings import literal_pronunciation
+
+FORMAT_VERSION = 1
+
+
+class ReadingBucket(NamedTuple):
+    pronunciation: str  # literal_pronunciation() of every variant
+    variants: tuple[str, ...]  # spellings seen in the records, in the order they were first seen
+    keys: tuple[str, ...]  # keys of the records with any of these spellings
+
+
+class ReadingIndex:
+    """
+    Groups (key, reading) records, e.g. the entries of the NHK pitch accent file,
+    by literal_pronunciation() of the reading, so that readings that only differ by 'ー'
+    or by kana that sound the same end up in one bucket.
+    Each distinct reading is normalized once. Buckets can be looked up by any spelling.
+    """
+
+    _buckets: list[ReadingBucket]
+    _by_spelling: dict[str, int]  # every variant and every pronunciation => bucket number
+    _by_key: dict[str, tuple[int, ...]]  # key => numbers of the buckets it appears in
+
+    def __init__(self, buckets: Iterable[ReadingBucket] = ()) -> None:
+        self._buckets = list(buckets)
+        self._by_spelling = {}
+        by_key: dict[str, list[int]] = {}
+        for idx, bucket in enumerate(self._buckets):
+            for variant in bucket.variants:
+                self._by_spelling[variant] = idx
+            for key in bucket.keys:
+                by_key.setdefault(key, []).append(idx)
+        for idx, bucket in enumerate(self._buckets):
+            # A spelling that was seen in the records takes precedence.
+            self._by_spelling.setdefault(bucket.pronunciation, idx)
+        self._by_key = {key: tuple(indices) for key, indices in by_key.items()}
+
+    @classmethod
+    def build(cls, records: Iterable[tuple[str, str]]) -> "ReadingIndex":
+        pronunciations: dict[str, str] = {}  # reading => pronunciation, normalizes each distinct reading once
+        variants: dict[str, dict[str, None]] = {}  # pronunciation => readings, dicts keep the insertion order
+        keys: dict[str, dict[str, None]] = {}  # pronunciation => keys
+        for key, reading in records:
+            try:
+                pronunciation = pronunciations[reading]
+            except KeyError:
+                pronunciation = pronunciations[reading] = literal_pronunciation(reading)
+                variants.setdefault(pronunciation, {})[reading] = None
+            keys.setdefault(pronunciation, {})[key] = None
+        return cls(
+            ReadingBucket(pronunciation, tuple(variants[pronunciation]), tuple(bucket_keys))
+            for pronunciation, bucket_keys in keys.items()
+        )
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def buckets(self) -> Sequence[ReadingBucket]:
+        return self._buckets
+
+    def pronunciation(self, reading: str) -> str:
+        """Same as literal_pronunciation(), but readings present in the index aren't normalized again."""
+        try:
+            return self._buckets[self._by_spelling[reading]].pronunciation
+        except KeyError:
+            return literal_pronunciation(reading)
+
+    def lookup(self, reading: str) -> Optional[ReadingBucket]:
+        """The bucket of a reading spelled in any way, including spellings that aren't in the index."""
+        try:
+            return self._buckets[self._by_spelling[reading]]
+        except KeyError:
+            pass
+        try:
+            return self._buckets[self._by_spelling[literal_pronunciation(reading)]]
+        except KeyError:
+            return None
+
+    def readings_of(self, key: str) -> tuple[str, ...]:
+        """The distinct readings of a key, one spelling per pronunciation."""
+        return tuple(self._buckets[idx].variants[0] for idx in self._by_key.get(key, ()))
+
+    def to_bytes(self) -> bytes:
+        return gzip.compress(
+            json.dumps(
+                {"version": FORMAT_VERSION, "buckets": [list(bucket) for bucket in self._buckets]},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            ).encode("utf-8")
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ReadingIndex":
+        obj = json.loads(gzip.decompress(data))
+        if obj.get("version") != FORMAT_VERSION:
+            raise ValueError("unsupported reading index version.")
+        return cls(
+            ReadingBucket(pronunciation, tuple(variants), tuple(keys))
+            for pronunciation, variants, keys in obj["buckets"]
+        )
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> "ReadingIndex":
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+def main():
+    import time
+
+    index = ReadingIndex.build(
+        [
+            ("学校", "がっこう"),
+            ("学校", "ガッコー"),
+            ("学校", "がっこー"),
+            ("今は", "いまは"),
+            ("今は", "イマワ"),
+            ("竜", "りゅう"),
+        ]
+    )
+    assert len(index) == 3
+    assert index.lookup("ガッコウ") == ReadingBucket(
+        pronunciation="ガッコー",
+        variants=("がっこう", "ガッコー", "がっこー"),
+        keys=("学校",),
+    )
+    assert index.lookup("いまわ").keys == ("今は",)
+    assert index.lookup("ねこ") is None
+    assert index.readings_of("学校") == ("がっこう",)
+    assert index.readings_of("今は") == ("いまは",)
+    assert index.pronunciation("りゅう") == "リュー"
+    restored = ReadingIndex.from_bytes(index.to_bytes())
+    assert list(restored.buckets()) == list(index.buckets())
+    assert restored.lookup("ガッコウ") == index.lookup("ガッコウ")
+
+    # Bulk build compared to calling literal_pronunciation() for every record.
+    readings = ("がっこう", "ガッコー", "じょうず", "おおきい", "りゅう")
+    records = [(f"key{idx % 50_000}", f"{readings[idx % 5]}{idx % 1000}") for idx in range(200_000)]
+    start = time.perf_counter()
+    for _, reading in records:
+        literal_pronunciation(reading)
+    naive_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    index = ReadingIndex.build(records)
+    build_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    ReadingIndex.from_bytes(index.to_bytes())
+    reload_elapsed = time.perf_counter() - start
+    print(f"normalize one by one: {naive_elapsed:.3f} s, build: {build_elapsed:.3f} s, reload: {reload_elapsed:.3f} s")
+    print("Ok.")
+
+
+if __name__ == "__main__":
+    main()
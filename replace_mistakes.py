@@ -1,7 +1,7 @@
 # Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 import dataclasses
-from collections.abc import Iterable, Sequence
+from collections.abc import Iterable, Iterator, Sequence
 from typing import Optional
 
 try:
@@ -24,6 +24,28 @@ def replace_mistakes(tokens: Iterable[MecabParsedToken]) -> Iterable[MecabParsed
         yield from replace_mistake(wrapped.token, consumed, idx)
 
 
+# How many of the following tokens replace_mistake() may look at.
+LOOKAHEAD = 2
+
+
+def iter_replace_mistakes(tokens: Iterable[MecabParsedToken]) -> Iterator[MecabParsedToken]:
+    """
+    Like replace_mistakes(), but yields fixed tokens as soon as the tokens they depend on have arrived,
+    instead of consuming all tokens first.
+    """
+    consumed: list[WrappedToken] = []
+    pos = 0
+    for token in tokens:
+        consumed.append(WrappedToken(token))
+        while pos < len(consumed) - LOOKAHEAD:
+            if not consumed[pos].skip:
+                yield from replace_mistake(consumed[pos].token, consumed, pos)
+            pos += 1
+    for idx in range(pos, len(consumed)):
+        if not consumed[idx].skip:
+            yield from replace_mistake(consumed[idx].token, consumed, idx)
+
+
 def slice_headwords(context: Sequence[WrappedToken], start: int, end: int) -> Optional[tuple[str, ...]]:
     try:
         return tuple(context[idx].token.headword for idx in range(start, end))
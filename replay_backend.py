@@ -0,0 +1,191 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Record mecab's raw output for a corpus once, then replay it without running mecab.
+This makes the Python side (parsing, replace_mistakes, formatting) deterministic to profile and benchmark:
+
+    python -m mecab_controller.replay_backend record corpus.txt corpus.fixture
+    python -m mecab_controller.replay_backend bench corpus.txt corpus.fixture
+"""
+
+import argparse
+import struct
+import threading
+import time
+import zlib
+from collections.abc import Iterator, Sequence
+from typing import Optional
+
+try:
+    from .backends import MecabBackend
+    from .request_coalescer import split_batch_output
+except ImportError:
+    from backends import MecabBackend
+    from request_coalescer import split_batch_output
+
+FIXTURE_MAGIC = b"AJTR"
+FIXTURE_HEADER = struct.Struct("<4sI")  # magic, number of records
+FIELD_LEN = struct.Struct("<I")
+
+
+class ReplayMissError(LookupError):
+    """The input wasn't recorded in the fixture."""
+
+
+def dump_fixture(records: dict[str, str]) -> bytes:
+    """zlib-compressed length-prefixed (input, output) pairs."""
+    out = bytearray(FIXTURE_HEADER.pack(FIXTURE_MAGIC, len(records)))
+    for expr, output in records.items():
+        for field in (expr, output):
+            data = field.encode("utf-8")
+            out += FIELD_LEN.pack(len(data))
+            out += data
+    return zlib.compress(bytes(out))
+
+
+def load_fixture(data: bytes) -> dict[str, str]:
+    data = zlib.decompress(data)
+    magic, n_records = FIXTURE_HEADER.unpack_from(data)
+    if magic != FIXTURE_MAGIC:
+        raise ValueError("not a mecab fixture.")
+    fields = []
+    pos = FIXTURE_HEADER.size
+    for _ in range(n_records * 2):
+        (size,) = FIELD_LEN.unpack_from(data, pos)
+        pos += FIELD_LEN.size
+        fields.append(data[pos : pos + size].decode("utf-8"))
+        pos += size
+    return dict(zip(fields[::2], fields[1::2]))
+
+
+class RecordingMecabController:
+    """
+    Passes inputs to another backend and records its output.
+    Multi-line batches are recorded line by line, so that the fixture doesn't depend on how inputs were batched.
+    """
+
+    _inner: MecabBackend
+    _records: dict[str, str]
+    _lock: threading.Lock
+
+    def __init__(self, inner: MecabBackend) -> None:
+        self._inner = inner
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def run(self, expr: str) -> str:
+        output = self._inner.run(expr)
+        lines = expr.split("\n")
+        outputs = split_batch_output(output, len(lines)) if len(lines) > 1 else (output,)
+        with self._lock:
+            self._records.update(zip(lines, outputs))
+        return output
+
+    def iter_run(self, expr: str, separator: str) -> Iterator[str]:
+        yield from self.run(expr).split(separator)
+
+    def buffer_bytes(self) -> int:
+        return self._inner.buffer_bytes()
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            data = dump_fixture(self._records)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+class ReplayMecabController:
+    """
+    Replays recorded output instead of running mecab. No subprocess is started.
+    Raises ReplayMissError for inputs that weren't recorded.
+    """
+
+    _records: dict[str, str]
+
+    def __init__(self, records: dict[str, str]) -> None:
+        self._records = records
+
+    @classmethod
+    def load(cls, path: str) -> "ReplayMecabController":
+        with open(path, "rb") as f:
+            return cls(load_fixture(f.read()))
+
+    def run(self, expr: str) -> str:
+        try:
+            return "".join(self._records[line] for line in expr.split("\n"))
+        except KeyError as ex:
+            raise ReplayMissError(f"input wasn't recorded: {ex.args[0]!r}") from None
+
+    def iter_run(self, expr: str, separator: str) -> Iterator[str]:
+        yield from self.run(expr).split(separator)
+
+    def buffer_bytes(self) -> int:
+        return 0
+
+
+def benchmark_pipeline(backend: ReplayMecabController, exprs: Sequence[str], rounds: int = 10) -> dict[str, float]:
+    """Seconds spent in each stage of the reading() pipeline, summed over all rounds."""
+    try:
+        from .escape import escape_text
+        from .mecab_controller import format_reading, parse_mecab_output
+        from .replace_mistakes import replace_mistakes
+    except ImportError:
+        from escape import escape_text
+        from mecab_controller import format_reading, parse_mecab_output
+        from replace_mistakes import replace_mistakes
+
+    timings = dict.fromkeys(("escape", "replay", "parse", "replace_mistakes", "format"), 0.0)
+    for _ in range(rounds):
+        for expr in exprs:
+            t0 = time.perf_counter()
+            escaped = escape_text(expr)
+            t1 = time.perf_counter()
+            raw = backend.run(escaped)
+            t2 = time.perf_counter()
+            tokens = tuple(parse_mecab_output(raw))
+            t3 = time.perf_counter()
+            tokens = tuple(replace_mistakes(tokens))
+            t4 = time.perf_counter()
+            format_reading(tokens)
+            t5 = time.perf_counter()
+            for stage, elapsed in zip(timings, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+                timings[stage] += elapsed
+    return timings
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    try:
+        from .mecab_controller import MecabController
+    except ImportError:
+        from mecab_controller import MecabController
+
+    parser = argparse.ArgumentParser(description="Record mecab's output for a corpus, or benchmark using a recording.")
+    parser.add_argument("action", choices=("record", "bench"))
+    parser.add_argument("corpus", help="text file, one input per line")
+    parser.add_argument("fixture", help="recorded output")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64, help="max inputs sent to mecab at once when recording")
+    args = parser.parse_args(argv)
+
+    with open(args.corpus, encoding="utf-8") as f:
+        exprs = [line.rstrip("\r\n") for line in f]
+
+    if args.action == "record":
+        recorder = RecordingMecabController(MecabController.make_backend())
+        with MecabController(backend=recorder) as mecab:
+            # Bounded batches, so that each one finishes within mecab's timeout.
+            for idx in range(0, len(exprs), args.batch_size):
+                mecab.translate_many(exprs[idx : idx + args.batch_size])
+        recorder.save(args.fixture)
+        print(f"recorded {len(exprs)} inputs to {args.fixture}")
+    else:
+        timings = benchmark_pipeline(ReplayMecabController.load(args.fixture), exprs, args.rounds)
+        n_calls = len(exprs) * args.rounds
+        for stage, elapsed in timings.items():
+            print(f"{stage:>16}: {elapsed:8.3f} s, {elapsed / n_calls * 1e6:8.1f} us/input")
+        print(f"{'total':>16}: {sum(timings.values()):8.3f} s, {n_calls / sum(timings.values()):8.1f} inputs/s")
+
+
+if __name__ == "__main__":
+    main()
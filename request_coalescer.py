@@ -0,0 +1,121 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import threading
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from .basic_mecab_controller import MecabError
+    from .basic_types import Separators
+except ImportError:
+    from basic_mecab_controller import MecabError
+    from basic_types import Separators
+
+
+def split_batch_output(raw: str, n_inputs: int) -> list[str]:
+    """
+    Split mecab's output for a multi-line batch into the output for each line.
+    Each part ends with the footer, like the output for a single line does.
+    """
+    parts = raw.split(Separators.footer)
+    if len(parts) != n_inputs + 1:
+        raise MecabError(f"expected output for {n_inputs} lines, got {len(parts) - 1}.")
+    return [part.lstrip("\r\n") + Separators.footer for part in parts[:-1]]
+
+
+class RequestCoalescer:
+    """
+    Collects inputs that arrive from concurrent callers within a short window
+    and sends them to mecab as one multi-line batch.
+    Each input must be a single line (see escape_text).
+    """
+
+    _run: Callable[[str], str]
+    _window: float
+    _max_items: int
+    _pending: list[tuple[str, Future]]
+    _cond: threading.Condition
+    _executor: ThreadPoolExecutor
+    _free_slots: threading.Semaphore
+    _flusher: threading.Thread
+    _closed: bool
+
+    def __init__(
+        self,
+        run: Callable[[str], str],
+        window: float = 0.005,
+        max_items: int = 64,
+        max_inflight: int = 2,
+    ) -> None:
+        self._run = run
+        self._window = window
+        self._max_items = max_items
+        self._pending = []
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="mecab_batch")
+        self._free_slots = threading.Semaphore(max_inflight)
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="mecab_coalescer", daemon=True)
+        self._flusher.start()
+
+    def submit(self, escaped: str) -> str:
+        """Blocks until mecab's output for this input is ready and returns it."""
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("coalescer is closed.")
+            self._pending.append((escaped, future))
+            if len(self._pending) == 1 or len(self._pending) >= self._max_items:
+                self._cond.notify()
+        return future.result()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._flusher.join()
+        self._executor.shutdown()
+
+    def _flush_loop(self) -> None:
+        while True:
+            # While all batches are in flight, new requests keep accumulating for the next batch.
+            self._free_slots.acquire()
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    self._free_slots.release()
+                    return
+                # The first request of a batch waits at most `window` seconds for others to join.
+                deadline = time.monotonic() + self._window
+                while len(self._pending) < self._max_items and not self._closed:
+                    if (remaining := deadline - time.monotonic()) <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[: self._max_items]
+                del self._pending[: self._max_items]
+            self._executor.submit(self._run_batch_in_slot, batch)
+
+    def _run_batch_in_slot(self, batch: Sequence[tuple[str, Future]]) -> None:
+        try:
+            self._run_batch(batch)
+        finally:
+            self._free_slots.release()
+
+    def _run_batch(self, batch: Sequence[tuple[str, Future]]) -> None:
+        try:
+            outputs = split_batch_output(self._run("\n".join(expr for expr, _ in batch)), len(batch))
+        except MecabError as ex:
+            if len(batch) == 1:
+                batch[0][1].set_exception(ex)
+                return
+            # Run the inputs one by one so that a single bad input doesn't fail its neighbors.
+            for item in batch:
+                self._run_batch([item])
+        except Exception as ex:
+            for _, future in batch:
+                future.set_exception(ex)
+        else:
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
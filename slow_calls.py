@@ -0,0 +1,196 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Records calls that take longer than a threshold, with the input and the time spent in each stage,
+so that pathological inputs can be found and reproduced offline:
+
+    python -m mecab_controller.slow_calls slow_calls.jsonl
+    python -m mecab_controller.slow_calls slow_calls.jsonl --export corpus.txt
+"""
+
+import argparse
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from typing import NamedTuple, Optional
+
+
+class SlowCall(NamedTuple):
+    timestamp: float  # unix time when the call started
+    operation: str  # e.g. "reading"
+    text: str
+    input_len: int
+    total_sec: float
+    stages: dict[str, float]  # seconds spent in each stage, e.g. {"cache": ..., "mecab": ..., "parse": ...}
+    cache: str  # "hit", "miss", "fallback" (known failure or circuit open) or "error" (mecab failed)
+    worker: str  # name of the thread that made the call
+    queue_depth: Optional[int]  # inputs waiting for a worker when the call started, if there are workers
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict(), ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, line: str) -> "SlowCall":
+        return cls(**json.loads(line))
+
+
+class ActiveCall:
+    __slots__ = ("timestamp", "start", "last", "stages", "cache")
+
+    def __init__(self) -> None:
+        self.timestamp = time.time()
+        self.start = self.last = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.cache = "miss"
+
+    def mark(self, stage: str) -> None:
+        """Adds the time since the previous mark to stage."""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+
+class SlowCallTracer:
+    """
+    Keeps the last `capacity` calls that took at least `threshold` seconds,
+    and if path is set, appends them to a JSON Lines file that is rotated when it reaches max_bytes.
+    Calls that finish in time cost a few clock reads and no allocations besides their stage timings.
+    """
+
+    _threshold: float
+    _recent: collections.deque[SlowCall]
+    _lock: threading.Lock
+    _local: threading.local
+    _handler: Optional[logging.handlers.RotatingFileHandler]
+
+    def __init__(
+        self,
+        threshold: float = 1.0,
+        capacity: int = 256,
+        path: Optional[str] = None,
+        max_bytes: int = 1024 * 1024,
+        backup_count: int = 3,
+    ) -> None:
+        self._threshold = threshold
+        self._recent = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._handler = (
+            logging.handlers.RotatingFileHandler(
+                path,
+                maxBytes=max_bytes,
+                backupCount=backup_count,
+                encoding="utf-8",
+                delay=True,
+            )
+            if path
+            else None
+        )
+
+    def active(self) -> Optional[ActiveCall]:
+        """The call being traced on this thread, if any."""
+        return getattr(self._local, "call", None)
+
+    def start(self) -> Optional[ActiveCall]:
+        """Starts tracing a call on this thread. Returns None if a call is already being traced (nested call)."""
+        if self.active() is not None:
+            return None
+        call = self._local.call = ActiveCall()
+        return call
+
+    def finish(self, call: ActiveCall, operation: str, text: str, queue_depth: Optional[int] = None) -> None:
+        self._local.call = None
+        total = time.perf_counter() - call.start
+        if total < self._threshold:
+            return
+        self.record(
+            SlowCall(
+                timestamp=call.timestamp,
+                operation=operation,
+                text=text,
+                input_len=len(text),
+                total_sec=total,
+                stages=call.stages,
+                cache=call.cache,
+                worker=threading.current_thread().name,
+                queue_depth=queue_depth,
+            )
+        )
+
+    def mark(self, stage: str) -> None:
+        """Ends a stage of the call being traced on this thread. Does nothing if there's none."""
+        if call := self.active():
+            call.mark(stage)
+
+    def set_cache_status(self, status: str) -> None:
+        if call := self.active():
+            call.cache = status
+
+    def record(self, slow_call: SlowCall) -> None:
+        with self._lock:
+            self._recent.append(slow_call)
+        if self._handler:
+            # The handler rotates the file and has its own lock.
+            self._handler.handle(logging.makeLogRecord({"msg": slow_call.to_json()}))
+
+    def recent(self) -> list[SlowCall]:
+        """Recorded calls, oldest first."""
+        with self._lock:
+            return list(self._recent)
+
+    def close(self) -> None:
+        if self._handler:
+            self._handler.close()
+
+
+def iter_slow_calls(path: str) -> Iterator[SlowCall]:
+    """Reads a trace file and the files it was rotated into, oldest first."""
+    rotated = []
+    idx = 1
+    while os.path.isfile(f"{path}.{idx}"):
+        rotated.append(f"{path}.{idx}")
+        idx += 1
+    for file_path in (*reversed(rotated), path):
+        if not os.path.isfile(file_path):
+            continue
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield SlowCall.from_json(line)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Show the slowest recorded calls.")
+    parser.add_argument("trace", help="file written by SlowCallTracer")
+    parser.add_argument("--top", type=int, default=20, help="number of calls to show")
+    parser.add_argument(
+        "--export",
+        help="write the distinct inputs, slowest first, one per line. "
+        "The file can be passed to load-test and replay_backend.",
+    )
+    args = parser.parse_args(argv)
+
+    calls = sorted(iter_slow_calls(args.trace), key=lambda call: call.total_sec, reverse=True)
+    for call in calls[: args.top]:
+        stages = ", ".join(f"{stage} {sec * 1000:.1f}" for stage, sec in call.stages.items())
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(call.timestamp))
+        print(
+            f"{started} {call.total_sec * 1000:9.1f} ms {call.operation} {call.cache} on {call.worker}, "
+            f"{call.input_len} chars ({stages}): {call.text[:60]!r}"
+        )
+    if args.export:
+        # Inputs are escaped before analysis anyway, so line breaks don't matter.
+        inputs = dict.fromkeys(" ".join(call.text.splitlines()) for call in calls)
+        with open(args.export, "w", encoding="utf-8") as f:
+            f.writelines(f"{text}\n" for text in inputs)
+        print(f"wrote {len(inputs)} inputs to {args.export}")
+
+
+if __name__ == "__main__":
+    main()
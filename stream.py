@@ -0,0 +1,194 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Analyze large inputs line by line from the shell, e.g.
+
+    python -m mecab_controller stream --format jsonl subtitles.txt > tokens.jsonl
+"""
+
+import argparse
+import collections
+import contextlib
+import itertools
+import json
+import os
+import sys
+import time
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, TextIO, TypeVar
+
+try:
+    from .basic_types import MecabParsedToken
+    from .corpus import iter_readings, iter_readings_threaded
+    from .dispatcher import Priority
+    from .mecab_controller import MecabController
+except ImportError:
+    from basic_types import MecabParsedToken
+    from corpus import iter_readings, iter_readings_threaded
+    from dispatcher import Priority
+    from mecab_controller import MecabController
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def ordered_map(fn: Callable[[T], R], items: Iterable[T], executor: ThreadPoolExecutor, window: int) -> Iterator[R]:
+    """
+    Like executor.map(), but keeps at most `window` items in flight,
+    so that the input doesn't have to fit in memory. Results are yielded in input order.
+    """
+    in_flight: collections.deque[Future] = collections.deque()
+    for item in items:
+        in_flight.append(executor.submit(fn, item))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def iter_lines(paths: Sequence[str]) -> Iterator[str]:
+    for path in paths:
+        if path == "-":
+            stdin = open(sys.stdin.fileno(), encoding="utf-8", errors="replace", closefd=False)
+            yield from (line.rstrip("\r\n") for line in stdin)
+        else:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                yield from (line.rstrip("\r\n") for line in f)
+
+
+def token_to_dict(token: MecabParsedToken) -> dict[str, Optional[str]]:
+    return {
+        "word": token.word,
+        "headword": token.headword,
+        "katakana_reading": token.katakana_reading,
+        "part_of_speech": token.part_of_speech.name,
+        "inflection_type": token.inflection_type.name,
+    }
+
+
+def iter_batches(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class Formatter:
+    """Turns a batch of input lines into output lines. Each batch is sent to mecab at once."""
+
+    def __init__(self, mecab: MecabController, output_format: str) -> None:
+        self._mecab = mecab
+        self._format = getattr(self, f"_format_{output_format}")
+
+    def __call__(self, lines: list[str]) -> list[str]:
+        return self._format(lines)
+
+    def _format_reading(self, lines: list[str]) -> list[str]:
+        return self._mecab.reading_many(lines, Priority.bulk)
+
+    def _format_tsv(self, lines: list[str]) -> list[str]:
+        readings = self._mecab.reading_many(lines, Priority.bulk)
+        return [f"{line.replace(chr(9), ' ')}\t{reading}" for line, reading in zip(lines, readings)]
+
+    def _format_jsonl(self, lines: list[str]) -> list[str]:
+        return [
+            json.dumps({"text": line, "tokens": [token_to_dict(token) for token in tokens]}, ensure_ascii=False)
+            for line, tokens in zip(lines, self._mecab.translate_many(lines, Priority.bulk))
+        ]
+
+
+def report_throughput(n_lines: int, n_chars: int, elapsed: float, out: TextIO) -> None:
+    elapsed = max(elapsed, 1e-9)
+    print(
+        f"{n_lines} lines, {n_chars} characters in {elapsed:.2f} s: "
+        f"{n_lines / elapsed:.1f} lines/s, {n_chars / elapsed:.1f} characters/s",
+        file=out,
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m mecab_controller stream",
+        description="Analyze input files (or stdin) line by line. Output lines are in input order.",
+    )
+    parser.add_argument("files", nargs="*", default=["-"], help="input files, '-' means stdin (default)")
+    parser.add_argument("-f", "--format", choices=("reading", "jsonl", "tsv"), default="reading")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 2, help="number of mecab workers")
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=0,
+        help="analyze in this many processes instead of threads (reading and tsv formats only)",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=0,
+        help="analyze chunks of lines on this many threads sharing one controller, "
+        "which scales like --processes on free-threaded Python (reading and tsv formats only)",
+    )
+    parser.add_argument("--batch-size", type=int, default=64, help="max lines sent to mecab at once")
+    parser.add_argument("--cache-size", type=int, default=4096, help="number of cached analyses")
+    parser.add_argument("--backend", default="subprocess", help="subprocess, persistent, libmecab, fugashi or auto")
+    parser.add_argument("-q", "--quiet", action="store_true", help="don't report throughput to stderr")
+    args = parser.parse_args(argv)
+    if (args.processes or args.threads) and args.format == "jsonl":
+        parser.error("--processes and --threads only support the reading and tsv formats.")
+
+    n_lines, n_chars = 0, 0
+
+    def counted(lines: Iterable[str]) -> Iterator[str]:
+        nonlocal n_lines, n_chars
+        for line in lines:
+            n_lines += 1
+            n_chars += len(line)
+            yield line
+
+    start = time.perf_counter()
+    out = sys.stdout
+    with contextlib.ExitStack() as stack:
+        if args.processes or args.threads:
+            lines_to_read = counted(iter_lines(args.files))
+            if args.format == "tsv":
+                # The tee only holds the lines between the ones being read and the ones printed,
+                # i.e. the chunks in flight.
+                lines, lines_to_read = itertools.tee(lines_to_read)
+            if args.processes:
+                results = iter_readings(
+                    lines_to_read,
+                    processes=args.processes,
+                    cache_max_size=args.cache_size,
+                    backend=args.backend,
+                )
+            else:
+                results = iter_readings_threaded(
+                    lines_to_read,
+                    threads=args.threads,
+                    cache_max_size=args.cache_size,
+                    backend=args.backend,
+                )
+            if args.format == "tsv":
+                results = (f"{line.replace(chr(9), ' ')}\t{result}" for line, result in zip(lines, results))
+        else:
+            mecab = stack.enter_context(
+                MecabController(workers=args.workers, cache_max_size=args.cache_size, backend=args.backend)
+            )
+            # One task per batch. The batches are analyzed by the controller's workers.
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=args.workers))
+            batches = iter_batches(counted(iter_lines(args.files)), args.batch_size)
+            results = itertools.chain.from_iterable(
+                ordered_map(Formatter(mecab, args.format), batches, executor, window=args.workers * 2)
+            )
+        for result in results:
+            out.write(result)
+            out.write("\n")
+    out.flush()
+    if not args.quiet:
+        report_throughput(n_lines, n_chars, time.perf_counter() - start, sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
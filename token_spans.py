@@ -0,0 +1,120 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+from collections.abc import Callable, Iterable, Sequence
+
+try:
+    from .basic_types import Inflection, MecabParsedToken, PartOfSpeech, TextEdit, TokenSpan
+    from .escape import RE_MARKUP, escape_text_with_offsets
+except ImportError:
+    from basic_types import Inflection, MecabParsedToken, PartOfSpeech, TextEdit, TokenSpan
+    from escape import RE_MARKUP, escape_text_with_offsets
+
+# Edits are re-analyzed from the start of the sentence they touch up to the end of the sentence.
+SENTENCE_ENDS = frozenset("。！？!?\n")
+MARKUP_CHARS = frozenset("<>[]")
+
+
+def align_tokens(escaped: str, offsets: Sequence[int], tokens: Iterable[MecabParsedToken]) -> list[TokenSpan]:
+    """
+    Find each token in the escaped text and map its position back to the original text.
+    `offsets` are the positions of the escaped text's characters in the original text (see escape_text_with_offsets).
+    """
+    spans = []
+    cursor = 0
+    for token in tokens:
+        if (start := escaped.find(token.word, cursor)) < 0:
+            # mecab changed the word somehow. Assume it starts where the previous token ended.
+            start = min(cursor, len(escaped))
+        end = min(start + len(token.word), len(escaped))
+        if start < end:
+            spans.append(TokenSpan(token, offsets[start], offsets[end - 1] + 1))
+        else:
+            prev_end = spans[-1].end if spans else 0
+            spans.append(TokenSpan(token, prev_end, prev_end))
+        cursor = end
+    return spans
+
+
+def shift_spans(spans: Iterable[TokenSpan], delta: int) -> list[TokenSpan]:
+    return [TokenSpan(span.token, span.start + delta, span.end + delta) for span in spans]
+
+
+def find_sentence_start(text: str, pos: int) -> int:
+    for idx in range(min(pos, len(text)) - 1, -1, -1):
+        if text[idx] in SENTENCE_ENDS:
+            return idx + 1
+    return 0
+
+
+def find_sentence_end(text: str, pos: int) -> int:
+    for idx in range(pos, len(text)):
+        if text[idx] in SENTENCE_ENDS:
+            return idx + 1
+    return len(text)
+
+
+def touches_markup(text: str, start: int, end: int) -> bool:
+    """Whether text[start:end] (or an insertion at start) can change which parts of text are markup."""
+    if not MARKUP_CHARS.isdisjoint(text[start:end]):
+        return True
+    return any(match.start() < start and end < match.end() for match in RE_MARKUP.finditer(text))
+
+
+def reanalyze(
+    translate_spans: Callable[[str], Sequence[TokenSpan]],
+    old_text: str,
+    old_spans: Sequence[TokenSpan],
+    edit: TextEdit,
+) -> list[TokenSpan]:
+    """
+    Return spans for edit.apply(old_text).
+    Only the sentences touched by the edit are analyzed again, tokens outside of them are reused.
+    Edits that add, remove or change markup may affect text outside of the sentence, so the whole text is analyzed.
+    """
+    new_text = edit.apply(old_text)
+    if touches_markup(old_text, edit.start, edit.end) or touches_markup(
+        new_text, edit.start, edit.start + len(edit.replacement)
+    ):
+        return list(translate_spans(new_text))
+
+    # The region to re-analyze in old_text coordinates, snapped to token boundaries.
+    left = find_sentence_start(old_text, edit.start)
+    right = find_sentence_end(old_text, edit.end)
+    reused_before = [span for span in old_spans if span.end <= left]
+    reused_after = [span for span in old_spans if span.start >= right]
+    left = reused_before[-1].end if reused_before else 0
+    right = reused_after[0].start if reused_after else len(old_text)
+
+    delta = len(edit.replacement) - (edit.end - edit.start)
+    new_region = new_text[left : right + delta]
+    return [
+        *reused_before,
+        *shift_spans(translate_spans(new_region), left),
+        *shift_spans(reused_after, delta),
+    ]
+
+
+def main():
+    def translate_spans(text: str) -> list[TokenSpan]:
+        # One token per character is enough to check that the spans line up.
+        escaped, offsets = escape_text_with_offsets(text)
+        tokens = [MecabParsedToken(char, char, None, PartOfSpeech(None), Inflection(None)) for char in escaped]
+        return align_tokens(escaped, offsets, tokens)
+
+    cases = [
+        # The tags start in the sentence before the edit.
+        ("太字<b。い>です", TextEdit(6, 7, "")),  # breaks a tag
+        ("太字<b。いです", TextEdit(6, 6, ">")),  # completes a tag
+        ("音[sound:。a.mp3]です", TextEdit(9, 9, "x")),  # edits inside a tag
+        ("音[sound。a.mp3]です", TextEdit(7, 7, ":")),  # completes a tag without touching brackets
+        ("今日は。いい天気です。", TextEdit(6, 8, "晴れ")),  # plain edit, only one sentence is analyzed
+    ]
+    for old_text, edit in cases:
+        expected = translate_spans(edit.apply(old_text))
+        assert reanalyze(translate_spans, old_text, translate_spans(old_text), edit) == expected, (old_text, edit)
+    print("Ok.")
+
+
+if __name__ == "__main__":
+    main()